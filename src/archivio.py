@@ -0,0 +1,273 @@
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from urllib.parse import quote
+
+import cache
+
+STORE_PATH = os.environ.get("TRIPLANNER_STORE", os.path.join(cache.CACHE_DIR, "monumenti.sqlite3"))
+COMMONS_FILEPATH = "http://commons.wikimedia.org/wiki/Special:FilePath/"
+
+DEFAULT_INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Righe del dump per lotto e lotti in volo per processo: limitano la memoria usata dall'ingestione
+BATCH_LINES = 2000
+MAX_PENDING_PER_WORKER = 2
+COMMIT_EVERY = 50
+
+# Insiemi di classi usati dai processi di ingestione (impostati da _init_worker)
+_included: Set[str] = set()
+_excluded: Set[str] = set()
+
+
+def _open_dump(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _iter_batches(path: str, size: int = BATCH_LINES) -> Iterator[List[str]]:
+    # Il dump JSON di Wikidata è un array con un'entità per riga
+    batch = []
+    with _open_dump(path) as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if not line or line in ("[", "]"):
+                continue
+            batch.append(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _truthy(claims: Dict, prop: str) -> List:
+    # Come wdt: in SPARQL: solo le dichiarazioni di rango migliore, mai quelle deprecate
+    statements = [s for s in claims.get(prop, []) if s.get("rank") != "deprecated"
+                  and s.get("mainsnak", {}).get("snaktype") == "value"]
+    preferred = [s for s in statements if s.get("rank") == "preferred"]
+    return [s["mainsnak"]["datavalue"]["value"] for s in preferred or statements]
+
+
+def _entity_id(value) -> Optional[str]:
+    return value.get("id") if isinstance(value, dict) else None
+
+
+def _text(entity: Dict, field: str, lang: str) -> Optional[str]:
+    return entity.get(field, {}).get(lang, {}).get("value")
+
+
+def parse_entity(entity: Dict, included: Set[str], excluded: Set[str]) -> Optional[Tuple[Tuple, List[str]]]:
+    # (riga del monumento, città P131) se l'entità rispetta le stesse regole della query SPARQL
+    claims = entity.get("claims", {})
+    cities = [q for q in map(_entity_id, _truthy(claims, "P131")) if q]
+    if not cities:
+        return None
+    classes = {q for q in map(_entity_id, _truthy(claims, "P31")) if q}
+    if not classes & included or classes & excluded:
+        return None
+
+    qid = entity["id"]
+    images = _truthy(claims, "P18")
+    coords = [c for c in _truthy(claims, "P625") if isinstance(c, dict)]
+    sitelinks = entity.get("sitelinks", {})
+    row = (
+        qid,
+        _text(entity, "labels", "it") or _text(entity, "labels", "en") or qid,
+        _text(entity, "descriptions", "it"),
+        _text(entity, "descriptions", "en"),
+        COMMONS_FILEPATH + quote(images[0]) if images else None,
+        coords[0].get("latitude") if coords else None,
+        coords[0].get("longitude") if coords else None,
+        sitelinks.get("itwiki", {}).get("title"),
+        sitelinks.get("enwiki", {}).get("title"),
+        len(sitelinks),
+    )
+    return row, cities
+
+
+def _init_worker(included: Set[str], excluded: Set[str]):
+    global _included, _excluded
+    _included, _excluded = included, excluded
+
+
+def _parse_batch(lines: List[str]) -> Tuple[int, List[Tuple[Tuple, List[str]]]]:
+    parsed = []
+    for line in lines:
+        try:
+            entity = json.loads(line)
+        except ValueError:
+            continue
+        if entity.get("type") != "item":
+            continue
+        result = parse_entity(entity, _included, _excluded)
+        if result:
+            parsed.append(result)
+    return len(lines), parsed
+
+
+class MonumentStore:
+    # Archivio locale dei monumenti, indicizzato per città (P131)
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS monuments (
+                qid TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                description_it TEXT,
+                description_en TEXT,
+                image TEXT,
+                lat REAL,
+                lon REAL,
+                it_title TEXT,
+                en_title TEXT,
+                sitelinks INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS monument_cities (
+                city TEXT NOT NULL,
+                qid TEXT NOT NULL,
+                PRIMARY KEY (city, qid)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def add(self, parsed: Sequence[Tuple[Tuple, List[str]]]):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO monuments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [row for row, _ in parsed])
+            self._conn.executemany("INSERT OR IGNORE INTO monument_cities VALUES (?, ?)",
+                                   [(city, row[0]) for row, cities in parsed for city in cities])
+
+    def set_meta(self, **values):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                   [(k, json.dumps(v)) for k, v in values.items()])
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def has_city(self, city_qid: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM monument_cities WHERE city = ? LIMIT 1",
+                                      (city_qid,)).fetchone() is not None
+
+    def monument_rows(self, city_qid: str, limit: int = 100) -> List[Dict]:
+        # Stesso formato delle righe SPARQL analizzate; prima i monumenti con più voci Wikipedia
+        with self._lock:
+            result = self._conn.execute("""
+                SELECT m.qid, m.label, m.description_it, m.description_en, m.image, m.lat, m.lon,
+                       m.it_title, m.en_title, m.sitelinks
+                FROM monument_cities c JOIN monuments m ON m.qid = c.qid
+                WHERE c.city = ?
+                ORDER BY m.sitelinks DESC, m.qid
+                LIMIT ?
+            """, (city_qid, limit)).fetchall()
+        rows = []
+        for qid, label, desc_it, desc_en, image, lat, lon, it_title, en_title, sitelinks in result:
+            titles = {lang: t for lang, t in (("it", it_title), ("en", en_title)) if t}
+            rows.append({"qid": qid, "label": label, "description": desc_it or desc_en or "", "image": image,
+                         "titles": titles, "coord": (lat, lon) if lat is not None and lon is not None else None,
+                         "sitelinks": sitelinks})
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[MonumentStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[MonumentStore]:
+    # None se l'archivio non è mai stato generato: in quel caso si usa Wikidata online
+    global _store
+    with _store_lock:
+        if _store is None and os.path.exists(STORE_PATH):
+            _store = MonumentStore(STORE_PATH)
+        return _store
+
+
+def _class_sets() -> Tuple[Set[str], Set[str]]:
+    import classi
+    from itinerario import EXCLUDED_MONUMENT_CLASSES, MONUMENT_CLASSES
+
+    hierarchy = classi.get_hierarchy()
+    sets = []
+    for roots in (MONUMENT_CLASSES, EXCLUDED_MONUMENT_CLASSES):
+        classes = set()
+        for root, comment in roots:
+            closure = hierarchy.closure(root)
+            if closure is None:
+                raise RuntimeError(f"Gerarchia di wd:{root} ({comment}) non disponibile: "
+                                   f"serve almeno un accesso a Wikidata per calcolarla")
+            classes.update(closure)
+        sets.append(classes)
+    return sets[0], sets[1]
+
+
+def ingest_dump(dump_path: str, store_path: str = STORE_PATH, workers: int = DEFAULT_INGEST_WORKERS,
+                batch_lines: int = BATCH_LINES) -> int:
+    included, excluded = _class_sets()
+    # L'archivio viene costruito a parte e sostituito solo alla fine: l'app non vede mai dati a metà
+    tmp_path = f"{store_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    store = MonumentStore(tmp_path)
+
+    started = time.time()
+    seen = stored = batches = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(included, excluded)) as pool:
+        pending = set()
+        for batch in _iter_batches(dump_path, batch_lines):
+            if len(pending) >= workers * MAX_PENDING_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    count, parsed = future.result()
+                    seen += count
+                    stored += len(parsed)
+                    store.add(parsed)
+                    batches += 1
+                    if batches % COMMIT_EVERY == 0:
+                        store.commit()
+                        print(f"📦 {seen} entità lette, {stored} monumenti ({time.time() - started:.0f}s)")
+            pending.add(pool.submit(_parse_batch, batch))
+        for future in pending:
+            count, parsed = future.result()
+            seen += count
+            stored += len(parsed)
+            store.add(parsed)
+
+    store.set_meta(dump=os.path.abspath(dump_path), ingested=time.time(), entities=seen, monuments=stored)
+    store.commit()
+    store.close()
+    os.replace(tmp_path, store_path)
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea l'archivio locale dei monumenti da un dump JSON di Wikidata")
+    parser.add_argument("dump", help="Dump JSON di Wikidata (anche .gz o .bz2) o un suo sottoinsieme filtrato")
+    parser.add_argument("--output", default=STORE_PATH)
+    parser.add_argument("--workers", type=int, default=DEFAULT_INGEST_WORKERS)
+    parser.add_argument("--batch-lines", type=int, default=BATCH_LINES)
+    args = parser.parse_args()
+    count = ingest_dump(args.dump, args.output, args.workers, args.batch_lines)
+    print(f"✅ Archivio creato con {count} monumenti in {args.output}")
@@ -0,0 +1,86 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Tuple
+
+import metriche
+from info_monumento import (BATCH_SIZE, assign_source, complete_monument_data, is_complete,
+                            prepare_monuments_batch)
+from monumento import NO_DESCRIPTION, Monument
+
+DEFAULT_WORKERS = 8
+
+
+def _fallback_record(row: Dict) -> Monument:
+    # Record minimo con i soli dati Wikidata, usato se l'arricchimento fallisce
+    description, description_source = assign_source(row.get("description"), None, "Wikidata")
+    image, image_source = assign_source(row.get("image"), None, "Wikidata")
+    return Monument(
+        qid=row.get("qid"),
+        label=row["label"],
+        description=description or NO_DESCRIPTION,
+        description_source=description_source,
+        image=image,
+        image_source=image_source
+    )
+
+
+def _prepare_chunk(rows: List[Dict]):
+    with metriche.timer("stage_seconds", stage="enrichment_batch"):
+        return prepare_monuments_batch(rows)
+
+
+def _complete_one(args) -> Dict[str, str]:
+    data, row, retry_langs = args
+    with metriche.timer("monument_enrichment_seconds", mode="completion"):
+        return complete_monument_data(data, row.get("titles"), search=not row.get("titles"),
+                                      retry_langs=retry_langs)
+
+
+def iter_enriched(rows: List[Dict], max_workers: int = DEFAULT_WORKERS) -> Iterator[Tuple[int, Dict]]:
+    # Restituisce (indice, monumento) man mano che ogni arricchimento termina. Le richieste contemporanee
+    # per host restano quelle impostate all'avvio in rete (set_host_limit), condivise da tutti i lavori
+    if not rows:
+        return
+
+    # Un blocco di monumenti per richiesta multipla di riassunti Wikipedia: i blocchi partono insieme, i
+    # monumenti già completi escono appena il loro blocco è pronto e gli altri passano subito al completamento
+    chunks = [list(range(i, min(i + BATCH_SIZE, len(rows)))) for i in range(0, len(rows), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="arricchimento") as pool:
+        batches = {pool.submit(_prepare_chunk, [rows[i] for i in chunk]): chunk for chunk in chunks}
+        completions = {}
+        try:
+            while batches or completions:
+                done, _ = wait(list(batches) + list(completions), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in batches:
+                        chunk = batches.pop(future)
+                        try:
+                            prepared, retry = future.result()
+                        except Exception as e:
+                            print(f"⚠️ Arricchimento in blocco fallito: {e}")
+                            for idx in chunk:
+                                metriche.incr("monuments_enriched_total", result="fallback")
+                                yield idx, _fallback_record(rows[idx])
+                            continue
+                        for idx, data, langs in zip(chunk, prepared, retry):
+                            if is_complete(data):
+                                metriche.incr("monuments_enriched_total", result="batch")
+                                yield idx, data
+                            else:
+                                completions[pool.submit(_complete_one, (data, rows[idx], langs))] = idx
+                        continue
+
+                    idx = completions.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Arricchimento fallito per '{rows[idx]['label']}': {e}")
+                        result = _fallback_record(rows[idx])
+                        metriche.incr("monuments_enriched_total", result="fallback")
+                    else:
+                        metriche.incr("monuments_enriched_total",
+                                      result="complete" if is_complete(result) else "incomplete")
+                    yield idx, result
+        finally:
+            # Se chi consuma smette di iterare, i lavori non ancora avviati vengono annullati
+            for future in list(batches) + list(completions):
+                future.cancel()
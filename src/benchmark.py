@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+# Cache, gazetteer imparato e archivio locale sempre in una cartella temporanea, anche se
+# TRIPLANNER_CACHE_DIR è impostata: nessun effetto sull'installazione e nessuno stato da esecuzioni precedenti
+os.environ["TRIPLANNER_CACHE_DIR"] = tempfile.mkdtemp(prefix="triplanner-bench-")
+
+import cache  # noqa: E402
+import rete  # noqa: E402
+from info_monumento import chain, get_monument_data  # noqa: E402
+from itinerario import fetch_monuments_by_qid, find_city_candidates, plan_itinerary_by_popularity  # noqa: E402
+from stub_wikimedia import CITIES, FIXTURES_PATH, StubConfig, StubServer  # noqa: E402
+
+STAGES = ("cities", "monuments", "monument_data", "plan", "end_to_end")
+DEFAULT_CITIES = [name for _, name, _, _, _ in CITIES[:5]]
+DEFAULT_REPEAT = 3
+DEFAULT_DAYS = 3
+MONUMENT_SAMPLE = 5
+# Una variazione conta come regressione solo se supera sia la soglia relativa sia questo minimo in ms
+NOISE_FLOOR_MS = 2.0
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * p
+    lo, hi = int(pos), min(int(pos) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ms = [s * 1000 for s in samples]
+    return {"n": len(ms), "p50": round(percentile(ms, 0.5), 2), "p90": round(percentile(ms, 0.9), 2),
+            "p99": round(percentile(ms, 0.99), 2), "mean": round(sum(ms) / len(ms), 2) if ms else 0.0,
+            "max": round(max(ms, default=0.0), 2)}
+
+
+def _timed(samples: Dict[str, List[float]], stage: str, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    samples[stage].append(time.perf_counter() - started)
+    return result
+
+
+def reset_state():
+    # Ogni ripetizione parte dallo stesso stato: statistiche delle sorgenti e titoli segnati come inesistenti
+    # restano altrimenti da un giro all'altro e da una chiamata di run_benchmark alla successiva
+    chain.reset()
+    cache.get_cache().clear("missing")
+
+
+def run_city(city: str, samples: Dict[str, List[float]], days: int, limit: int):
+    started = time.perf_counter()
+    candidates = _timed(samples, "cities", find_city_candidates, city, use_gazetteer=False)
+    if not candidates:
+        raise RuntimeError(f"Nessuna città trovata per '{city}'")
+    monuments = _timed(samples, "monuments", fetch_monuments_by_qid, candidates[0]["qid"], limit)
+    _timed(samples, "plan", plan_itinerary_by_popularity, monuments, days)
+    samples["end_to_end"].append(time.perf_counter() - started)
+    # Arricchimento del singolo monumento, misurato a parte perché fuori dal percorso principale
+    for m in monuments[:MONUMENT_SAMPLE]:
+        _timed(samples, "monument_data", get_monument_data, m["label"], qid=m.get("qid"))
+
+
+def run_benchmark(cities: List[str], repeat: int = DEFAULT_REPEAT, warmup: int = 1, days: int = DEFAULT_DAYS,
+                  limit: int = 100, config: Optional[StubConfig] = None, fixtures: Optional[str] = FIXTURES_PATH,
+                  production_limits: bool = False) -> Dict:
+    config = config or StubConfig()
+    random.seed(config.seed)
+    stub = StubServer(config, fixtures).start()
+    endpoints = stub.endpoints()
+    rete.set_endpoints(endpoints["sparql"], endpoints["wikipedia"], endpoints["commons"])
+    if not production_limits:
+        # Senza token bucket si misura il codice e non il ritmo imposto ai servizi reali
+        rete.RATE_LIMITS[urlsplit(stub.url).netloc] = (1e9, 10 ** 9)
+    # Ogni ripetizione deve arrivare allo stub: nessuna risposta dalla cache HTTP
+    previous_mode = cache.get_mode()
+    cache.set_mode("bypass")
+
+    try:
+        for _ in range(warmup):
+            reset_state()
+            for city in cities:
+                run_city(city, defaultdict(list), days, limit)
+        stub.reset_counts()
+
+        samples: Dict[str, List[float]] = defaultdict(list)
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            reset_state()
+            for city in cities:
+                try:
+                    run_city(city, samples, days, limit)
+                except Exception as e:
+                    errors += 1
+                    print(f"⚠️ {city}: {e}", file=sys.stderr)
+        elapsed = time.perf_counter() - started
+    finally:
+        cache.set_mode(previous_mode)
+        stub.stop()
+
+    requests_by_route = {f"{route} {status}": n for (route, status), n in sorted(stub.counts.items())}
+    total_requests = sum(stub.counts.values())
+    return {
+        "config": {"cities": cities, "repeat": repeat, "days": days, "limit": limit, "latency": config.latency,
+                   "jitter": config.jitter, "error_rate": config.error_rate, "throttle_rate": config.throttle_rate,
+                   "seed": config.seed, "fixtures": bool(stub.fixtures), "production_limits": production_limits},
+        "stages": {stage: summarize(samples[stage]) for stage in STAGES if samples[stage]},
+        "requests": requests_by_route,
+        "total_requests": total_requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": {"cities_per_s": round(len(samples["end_to_end"]) / elapsed, 3) if elapsed else 0.0,
+                       "requests_per_s": round(total_requests / elapsed, 1) if elapsed else 0.0},
+    }
+
+
+def print_report(report: Dict, out=sys.stdout):
+    print(f"\n{'fase':<15}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}   (ms)", file=out)
+    for stage, s in report["stages"].items():
+        print(f"{stage:<15}{s['n']:>6}{s['p50']:>10.1f}{s['p90']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}", file=out)
+    print(f"\nrichieste: {report['total_requests']}  "
+          + "  ".join(f"{k}: {v}" for k, v in report["requests"].items()), file=out)
+    t = report["throughput"]
+    print(f"durata {report['elapsed_s']:.2f}s, {t['cities_per_s']:.2f} città/s, {t['requests_per_s']:.1f} richieste/s, "
+          f"{report['errors']} errori", file=out)
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1, out=sys.stdout) -> List[str]:
+    # Confronto prima/dopo sui percentili di ogni fase; restituisce le regressioni trovate
+    regressions = []
+    print(f"\n{'fase':<15}{'metrica':>8}{'prima':>10}{'dopo':>10}{'diff':>9}", file=out)
+    for stage, now in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        for metric in ("p50", "p90"):
+            old, new = before[metric], now[metric]
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if change > threshold and new - old > NOISE_FLOOR_MS:
+                flag = "  ⚠️ regressione"
+                regressions.append(f"{stage} {metric}: {old:.1f} → {new:.1f} ms ({change:+.0%})")
+            print(f"{stage:<15}{metric:>8}{old:>10.1f}{new:>10.1f}{change:>+9.0%}{flag}", file=out)
+    old_req, new_req = baseline.get("total_requests"), current["total_requests"]
+    if old_req is not None and new_req > old_req:
+        regressions.append(f"richieste: {old_req} → {new_req}")
+    print(f"{'richieste':<15}{'':>8}{old_req if old_req is not None else '-':>10}{new_req:>10}", file=out)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark riproducibile contro uno stub locale di Wikimedia")
+    parser.add_argument("--cities", nargs="+", default=DEFAULT_CITIES)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02, help="Latenza dello stub in secondi")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Frazione di risposte 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Frazione di risposte 429")
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="Risposte registrate con stub_wikimedia.py --record")
+    parser.add_argument("--production-limits", action="store_true",
+                        help="Applica anche allo stub il token bucket predefinito")
+    parser.add_argument("--output", help="Salva il rapporto JSON (da usare poi come --baseline)")
+    parser.add_argument("--baseline", help="Rapporto JSON precedente con cui confrontare")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Peggioramento relativo tollerato")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.retry_after, args.seed)
+    # I messaggi dei moduli vanno su stderr, il rapporto su stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args.cities, args.repeat, args.warmup, args.days, args.limit, config, args.fixtures,
+                               args.production_limits)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print("\n⚠️ Regressioni:\n  " + "\n  ".join(regressions))
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import metriche
+
+CACHE_DIR = os.environ.get("TRIPLANNER_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "triplanner"))
+
+DAY = 24 * 3600
+
+# Durata delle risposte valide e di quelle "negative" (404, ricerche vuote) per sorgente
+TTL = {
+    "wikidata": 7 * DAY,
+    "wikipedia": 3 * DAY,
+    "commons": 7 * DAY,
+}
+NEGATIVE_TTL = {
+    "wikidata": 1 * DAY,
+    "wikipedia": 1 * DAY,
+    "commons": 1 * DAY,
+    # Titoli e ricerche riconosciuti come inesistenti (mark_missing), anche da risposte multiple
+    "missing": 30 * DAY,
+}
+DEFAULT_TTL = 1 * DAY
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# "use": legge e scrive, "refresh": ignora la cache in lettura ma la aggiorna, "bypass": nessun accesso
+MODES = ("use", "refresh", "bypass")
+
+
+def source_for(url: str) -> str:
+    host = urlsplit(url).netloc.lower()
+    if "wikidata.org" in host:
+        return "wikidata"
+    if "commons.wikimedia.org" in host:
+        return "commons"
+    if "wikipedia.org" in host:
+        return "wikipedia"
+    return host
+
+
+def make_key(endpoint: str, params: Optional[Dict] = None) -> str:
+    parts = urlsplit(endpoint)
+    normalized = f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}"
+    items = sorted((str(k), " ".join(str(v).split())) for k, v in (params or {}).items())
+    raw = json.dumps([normalized, items], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                value TEXT NOT NULL,
+                negative INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str, count: bool = True) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses += count
+                return False, None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += count
+        return True, json.loads(row[0])
+
+    def put(self, key: str, source: str, value: Any, negative: bool = False):
+        ttl = (NEGATIVE_TTL if negative else TTL).get(source, DEFAULT_TTL)
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, source, payload, int(negative), now + ttl, now, size)
+            )
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Elimina prima le voci scadute, poi le meno usate di recente fino al 90% del limite
+        now = time.time()
+        self._conn.execute("DELETE FROM responses WHERE expires < ?", (now,))
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if self._total <= target:
+            return
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if self._total - freed <= target:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._total -= freed
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total -= old[0]
+
+    def clear(self, source: Optional[str] = None):
+        with self._lock:
+            if source:
+                self._conn.execute("DELETE FROM responses WHERE source = ?", (source,))
+            else:
+                self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+_mode = os.environ.get("TRIPLANNER_CACHE_MODE", "use")
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(os.path.join(CACHE_DIR, "http_cache.sqlite3"))
+        return _cache
+
+
+def set_mode(mode: str):
+    global _mode
+    if mode not in MODES:
+        raise ValueError(f"Modalità cache non valida: {mode}")
+    _mode = mode
+
+
+def get_mode() -> str:
+    return _mode
+
+
+def cached_call(endpoint: str, params: Optional[Dict], fetch: Callable[[], Any],
+                is_negative: Optional[Callable[[Any], bool]] = None, source: Optional[str] = None) -> Any:
+    if _mode == "bypass":
+        return fetch()
+
+    store = get_cache()
+    key = make_key(endpoint, params)
+    source = source or source_for(endpoint)
+
+    if _mode == "use":
+        hit, value = store.get(key)
+        if hit:
+            metriche.incr("cache_hits_total", source=source)
+            return value
+    metriche.incr("cache_misses_total", source=source)
+
+    value = fetch()
+    negative = value is None or bool(is_negative and is_negative(value))
+    store.put(key, source, value, negative)
+    return value
+
+
+def _missing_key(kind: str, lang: str, title: str) -> str:
+    return make_key(f"missing:{kind}", {"lang": lang, "title": title})
+
+
+def is_missing(kind: str, lang: str, title: str) -> bool:
+    # Solo in modalità "use": con refresh e bypass i titoli vengono richiesti di nuovo
+    if _mode != "use":
+        return False
+    hit, _ = get_cache().get(_missing_key(kind, lang, title), count=False)
+    return hit
+
+
+def mark_missing(kind: str, lang: str, title: str):
+    if _mode != "bypass":
+        get_cache().put(_missing_key(kind, lang, title), "missing", True, negative=True)
+
+
+def forget_missing(kind: str, lang: str, title: str):
+    # Con refresh un titolo trovato di nuovo non deve restare segnato come inesistente
+    if _mode == "refresh":
+        get_cache().delete(_missing_key(kind, lang, title))
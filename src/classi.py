@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cache
+import rete
+
+CLOSURE_PATH = os.path.join(cache.CACHE_DIR, "class_closures.json")
+REFRESH_INTERVAL = 30 * cache.DAY
+CLOSURE_QUERY_TIMEOUT = 120
+# Dopo un errore la chiusura non viene richiesta di nuovo per questo intervallo
+FAILURE_BACKOFF = 600
+# Oltre questa dimensione la chiusura non viene espansa: il blocco VALUES costerebbe più del percorso P279*
+MAX_FLAT_CLASSES = 3000
+QIDS_PER_LINE = 8
+
+
+class ClassHierarchy:
+    # Chiusure wdt:P279* delle classi usate nelle query, calcolate una volta e salvate su disco
+    def __init__(self, path: str = CLOSURE_PATH, refresh_interval: float = REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._closures: Dict[str, Dict] = self._load()
+        self._failed: Dict[str, float] = {}
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._closures, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare le gerarchie di classi: {e}")
+
+    def _fetch(self, root: str) -> List[str]:
+        res = rete.sparql(f"SELECT ?c WHERE {{ ?c wdt:P279* wd:{root} . }}", timeout=CLOSURE_QUERY_TIMEOUT,
+                          retries=1)
+        return sorted({b["c"]["value"].split("/")[-1] for b in res.get("results", {}).get("bindings", [])})
+
+    def closure(self, root: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._closures.get(root)
+            failed_at = self._failed.get(root, 0)
+        now = time.time()
+        if entry and now - entry["fetched"] < self.refresh_interval:
+            return entry["classes"]
+        if now - failed_at < FAILURE_BACKOFF:
+            return entry["classes"] if entry else None
+        try:
+            classes = self._fetch(root)
+        except Exception as e:
+            # Meglio una chiusura scaduta che nessuna: altrimenti si torna al percorso P279*
+            print(f"⚠️ Gerarchia di wd:{root} non aggiornata: {e}")
+            with self._lock:
+                self._failed[root] = now
+            return entry["classes"] if entry else None
+        if root not in classes:
+            classes.append(root)
+        with self._lock:
+            self._closures[root] = {"fetched": time.time(), "classes": classes}
+            self._save()
+        return classes
+
+
+_hierarchy: Optional[ClassHierarchy] = None
+_hierarchy_lock = threading.Lock()
+
+
+def get_hierarchy() -> ClassHierarchy:
+    global _hierarchy
+    with _hierarchy_lock:
+        if _hierarchy is None:
+            _hierarchy = ClassHierarchy()
+        return _hierarchy
+
+
+def _split(roots: Sequence[Tuple[str, str]]) -> Tuple[List[str], List[Tuple[str, str]]]:
+    flat, deep = set(), []
+    hierarchy = get_hierarchy()
+    for root, comment in roots:
+        classes = hierarchy.closure(root)
+        if classes is None or len(classes) > MAX_FLAT_CLASSES:
+            deep.append((root, comment))
+        else:
+            flat.update(classes)
+    return sorted(flat), deep
+
+
+def _values_block(qids: Sequence[str], indent: str) -> str:
+    lines = [" ".join(f"wd:{q}" for q in qids[i:i + QIDS_PER_LINE]) for i in range(0, len(qids), QIDS_PER_LINE)]
+    return "\n".join(indent + line for line in lines)
+
+
+def class_constraint(subject: str, roots: Sequence[Tuple[str, str]], class_var: str = "class",
+                     indent: str = "      ") -> str:
+    # ?subject istanza di una delle classi (o sottoclassi) indicate, con un semplice wdt:P31 dove possibile
+    flat, deep = _split(roots)
+    parts = []
+    if flat:
+        parts.append(f"{{ ?{subject} wdt:P31 ?{class_var} .\n"
+                     f"{indent}  VALUES ?{class_var} {{\n{_values_block(flat, indent + '    ')}\n{indent}  }} }}")
+    if deep:
+        values = "\n".join(f"{indent}    wd:{c:<9} # {comment}" for c, comment in deep)
+        parts.append(f"{{ ?{subject} wdt:P31/wdt:P279* ?{class_var} .\n"
+                     f"{indent}  VALUES ?{class_var} {{\n{values}\n{indent}  }} }}")
+    return indent + f"\n{indent}UNION\n{indent}".join(parts)
+
+
+def exclusion_constraint(subject: str, roots: Sequence[Tuple[str, str]], class_var: str = "excludedClass",
+                         indent: str = "      ") -> str:
+    flat, deep = _split(roots)
+    parts = []
+    if flat:
+        parts.append(f"FILTER NOT EXISTS {{\n{indent}  ?{subject} wdt:P31 ?{class_var} .\n"
+                     f"{indent}  VALUES ?{class_var} {{\n{_values_block(flat, indent + '    ')}\n{indent}  }}\n"
+                     f"{indent}}}")
+    for c, comment in deep:
+        parts.append(f"MINUS {{ ?{subject} wdt:P31/wdt:P279* wd:{c} }}  # {comment}")
+    return "\n".join(indent + p for p in parts)
@@ -0,0 +1,232 @@
+import argparse
+import bisect
+import csv
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from unidecode import unidecode
+
+import cache
+
+GAZETTEER_PATH = os.environ.get("TRIPLANNER_GAZETTEER",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "cities.tsv"))
+LEARNED_PATH = os.path.join(cache.CACHE_DIR, "cities_learned.tsv")
+
+FIELDS = ["qid", "label_it", "label_en", "country", "population"]
+MAX_RESULTS = 20
+
+
+def normalize(name: str) -> str:
+    return " ".join(unidecode(name).lower().split())
+
+
+def _edit_distance_within(a: str, b: str, max_dist: int) -> bool:
+    if abs(len(a) - len(b)) > max_dist:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            row_min = min(row_min, current[j])
+        if row_min > max_dist:
+            return False
+        previous = current
+    return previous[-1] <= max_dist
+
+
+def read_entries(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8", newline="") as f:
+        entries = []
+        for row in csv.DictReader(f, delimiter="\t"):
+            row["population"] = int(row.get("population") or 0)
+            entries.append(row)
+        return entries
+
+
+def write_entries(path: str, entries: Iterable[Dict], append: bool = False):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    new_file = not append or not os.path.exists(path)
+    with open(path, "a" if append else "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, delimiter="\t", extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        writer.writerows(entries)
+
+
+class Gazetteer:
+    def __init__(self, entries: Iterable[Dict] = ()):
+        self._entries: Dict[str, Dict] = {}
+        self._keys: List[str] = []
+        self._qids: List[str] = []
+        self._by_initial: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        self.add(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entries: Iterable[Dict]) -> List[Dict]:
+        added = []
+        with self._lock:
+            for e in entries:
+                qid = e["qid"]
+                old = self._entries.get(qid)
+                if old:
+                    # Completa le etichette mancanti senza duplicare la città
+                    for field in ("label_it", "label_en", "country"):
+                        if not old.get(field) and e.get(field):
+                            old[field] = e[field]
+                    continue
+                self._entries[qid] = dict(e)
+                added.append(self._entries[qid])
+            if added:
+                self._rebuild()
+        return added
+
+    def _rebuild(self):
+        # Indice ordinato di (nome normalizzato, qid): il nome intero e ogni parola successiva,
+        # così "york" trova anche "New York"
+        pairs = set()
+        for qid, e in self._entries.items():
+            for label in (e.get("label_it"), e.get("label_en")):
+                if not label:
+                    continue
+                words = normalize(label).split()
+                for i in range(len(words)):
+                    pairs.add((" ".join(words[i:]), qid))
+        ordered = sorted(pairs)
+        self._keys = [k for k, _ in ordered]
+        self._qids = [q for _, q in ordered]
+        self._by_initial = {}
+        for idx, key in enumerate(self._keys):
+            self._by_initial.setdefault(key[:1], []).append(idx)
+
+    def _prefix_matches(self, query: str) -> List[str]:
+        lo = bisect.bisect_left(self._keys, query)
+        hi = bisect.bisect_right(self._keys, query + "\uffff")
+        return self._qids[lo:hi]
+
+    def _fuzzy_matches(self, query: str, max_typos: int) -> List[str]:
+        # Tollera errori di battitura confrontando il prefisso dei nomi con la stessa iniziale
+        found = []
+        for idx in self._by_initial.get(query[:1], []):
+            key = self._keys[idx]
+            if _edit_distance_within(query, key[:len(query)], max_typos) or \
+                    _edit_distance_within(query, key, max_typos):
+                found.append(self._qids[idx])
+        return found
+
+    def lookup(self, city_name: str, limit: int = MAX_RESULTS,
+               max_typos: int = 1) -> Tuple[List[Dict[str, str]], bool]:
+        # Restituisce anche se il risultato è affidabile: solo un nome completo identico lo è. Prefissi e parole
+        # finali ("Monaco" → Monaco di Baviera, "York" → New York) possono indicare altre città e richiedono SPARQL
+        query = normalize(city_name)
+        if not query:
+            return [], False
+        with self._lock:
+            qids = self._prefix_matches(query)
+            if not qids and max_typos and len(query) > 3:
+                qids = self._fuzzy_matches(query, max_typos)
+            entries = [self._entries[q] for q in dict.fromkeys(qids)]
+
+        def exact(e):
+            return query in (normalize(e.get("label_it") or ""), normalize(e.get("label_en") or ""))
+
+        trusted = any(exact(e) for e in entries)
+        ranked = sorted(entries, key=lambda e: (not exact(e), -e.get("population", 0)))
+        return [_to_candidate(e) for e in ranked[:limit]], trusted
+
+
+def _to_candidate(entry: Dict) -> Dict[str, str]:
+    lang = "it" if entry.get("label_it") else "en"
+    return {
+        "qid": entry["qid"],
+        "label": entry.get("label_it") or entry.get("label_en"),
+        "country": entry.get("country"),
+        "lang": lang
+    }
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer(read_entries(GAZETTEER_PATH))
+            _gazetteer.add(read_entries(LEARNED_PATH))
+        return _gazetteer
+
+
+def learn(candidates: List[Dict[str, str]], query: Optional[str] = None):
+    # Le città trovate via SPARQL vengono ricordate per le ricerche successive; con query si tengono solo
+    # quelle il cui nome coincide con il testo cercato, non tutte le corrispondenze parziali di CONTAINS
+    if query is not None:
+        wanted = normalize(query)
+        candidates = [c for c in candidates if normalize(c.get("label") or "") == wanted]
+    entries = [{
+        "qid": c["qid"],
+        "label_it": c["label"] if c.get("lang") == "it" else "",
+        "label_en": c["label"] if c.get("lang") != "it" else "",
+        "country": c.get("country") or "",
+        "population": 0
+    } for c in candidates if c.get("qid") and c.get("country")]
+    added = get_gazetteer().add(entries)
+    if added:
+        try:
+            write_entries(LEARNED_PATH, added, append=True)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare le città nel gazetteer locale: {e}")
+
+
+def build_gazetteer(path: str = GAZETTEER_PATH, min_population: int = 50000) -> int:
+    import rete
+
+    query = f"""
+    SELECT ?city ?itLabel ?enLabel ?countryLabel (MAX(?pop) AS ?population) WHERE {{
+      ?city wdt:P31/wdt:P279* wd:Q515 ;
+            wdt:P1082 ?pop ;
+            wdt:P17 ?country .
+      FILTER(?pop >= {min_population})
+      OPTIONAL {{ ?city rdfs:label ?itLabel . FILTER(LANG(?itLabel) = "it") }}
+      OPTIONAL {{ ?city rdfs:label ?enLabel . FILTER(LANG(?enLabel) = "en") }}
+      SERVICE wikibase:label {{
+        bd:serviceParam wikibase:language "it,en".
+        ?country rdfs:label ?countryLabel .
+      }}
+    }}
+    GROUP BY ?city ?itLabel ?enLabel ?countryLabel
+    """
+    res = rete.sparql(query, timeout=300)
+    entries = {}
+    for b in res.get("results", {}).get("bindings", []):
+        qid = b["city"]["value"].split("/")[-1]
+        entry = {
+            "qid": qid,
+            "label_it": b.get("itLabel", {}).get("value", ""),
+            "label_en": b.get("enLabel", {}).get("value", ""),
+            "country": b.get("countryLabel", {}).get("value", ""),
+            "population": int(float(b.get("population", {}).get("value", 0)))
+        }
+        if (entry["label_it"] or entry["label_en"]) and \
+                entry["population"] >= entries.get(qid, {}).get("population", -1):
+            entries[qid] = entry
+
+    write_entries(path, sorted(entries.values(), key=lambda e: e["qid"]))
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera il gazetteer locale delle città da Wikidata")
+    parser.add_argument("--output", default=GAZETTEER_PATH)
+    parser.add_argument("--min-population", type=int, default=50000)
+    args = parser.parse_args()
+    count = build_gazetteer(args.output, args.min_population)
+    print(f"✅ Gazetteer creato con {count} città in {args.output}")
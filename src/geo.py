@@ -0,0 +1,133 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_CLUSTER_ITERATIONS = 15
+MAX_TWO_OPT_PASSES = 20
+
+
+def haversine(a: np.ndarray, b: Optional[np.ndarray] = None) -> np.ndarray:
+    # Distanze in km tra tutte le coppie di punti (lat, lon) in gradi: matrice len(a) x len(b)
+    b = a if b is None else b
+    lat1, lon1 = np.radians(a[:, 0])[:, None], np.radians(a[:, 1])[:, None]
+    lat2, lon2 = np.radians(b[:, 0])[None, :], np.radians(b[:, 1])[None, :]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _initial_centers(coords: np.ndarray, dist: np.ndarray, k: int) -> np.ndarray:
+    # Inizializzazione deterministica per punti più lontani, a partire dal punto più centrale
+    chosen = [int(np.argmin(dist.sum(axis=1)))]
+    nearest = dist[chosen[0]].copy()
+    while len(chosen) < k:
+        nxt = int(np.argmax(nearest))
+        chosen.append(nxt)
+        nearest = np.minimum(nearest, dist[nxt])
+    return coords[chosen].copy()
+
+
+def _assign_with_capacity(to_centers: np.ndarray, capacities: Sequence[int]) -> np.ndarray:
+    # Assegnazione greedy per distanza crescente rispettando la capienza di ogni gruppo
+    n, k = to_centers.shape
+    assignment = np.full(n, -1)
+    free = np.array(capacities, dtype=int)
+    order = np.argsort(to_centers, axis=None, kind="stable")
+    remaining = n
+    for flat in order:
+        point, center = divmod(int(flat), k)
+        if assignment[point] >= 0 or free[center] == 0:
+            continue
+        assignment[point] = center
+        free[center] -= 1
+        remaining -= 1
+        if remaining == 0:
+            break
+    return assignment
+
+
+def cluster_by_capacity(coords: np.ndarray, capacities: Sequence[int],
+                        dist: Optional[np.ndarray] = None) -> List[List[int]]:
+    n, k = len(coords), len(capacities)
+    if n == 0 or k == 0:
+        return [[] for _ in range(k)]
+    if sum(capacities) < n:
+        raise ValueError("La capienza complessiva è inferiore al numero di punti")
+    dist = haversine(coords) if dist is None else dist
+
+    centers = _initial_centers(coords, dist, min(k, n))
+    if len(centers) < k:
+        centers = np.vstack([centers, np.repeat(centers[:1], k - len(centers), axis=0)])
+
+    assignment = None
+    for _ in range(MAX_CLUSTER_ITERATIONS):
+        new_assignment = _assign_with_capacity(haversine(coords, centers), capacities)
+        if assignment is not None and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        for c in range(k):
+            members = coords[assignment == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+
+    return [np.flatnonzero(assignment == c).tolist() for c in range(k)]
+
+
+def nearest_neighbour_route(dist: np.ndarray, start: int = 0) -> List[int]:
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    route = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[route[-1]])
+        nxt = int(np.argmin(row))
+        route.append(nxt)
+        visited[nxt] = True
+    return route
+
+
+def two_opt(route: List[int], dist: np.ndarray) -> List[int]:
+    # 2-opt su percorso aperto: per ogni i i guadagni su tutti i j sono calcolati in blocco
+    route = np.array(route)
+    n = len(route)
+    if n < 4:
+        return route.tolist()
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(n - 2):
+            a, b = route[i], route[i + 1]
+            js = np.arange(i + 2, n)
+            c = route[js]
+            d_next = np.append(route[js[:-1] + 1], -1)
+            # Invertire route[i+1..j]: si sostituiscono gli archi (a,b) e (c,d) con (a,c) e (b,d)
+            gain = dist[a, b] - dist[a, c]
+            has_next = d_next >= 0
+            gain[has_next] += dist[c[has_next], d_next[has_next]] - dist[b, d_next[has_next]]
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                j = int(js[best])
+                route[i + 1:j + 1] = route[i + 1:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def plan_route(dist: np.ndarray) -> List[int]:
+    n = len(dist)
+    if n <= 2:
+        return list(range(n))
+    # Si parte dal punto più periferico del gruppo, che in un percorso aperto è un buon estremo
+    start = int(np.argmax(dist.sum(axis=1)))
+    return two_opt(nearest_neighbour_route(dist, start), dist)
+
+
+def parse_wkt_point(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    # Wikidata restituisce le coordinate come "Point(lon lat)"
+    if not value or not value.startswith("Point(") or not value.endswith(")"):
+        return None
+    try:
+        lon, lat = (float(x) for x in value[len("Point("):-1].split())
+    except ValueError:
+        return None
+    return lat, lon
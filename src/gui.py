@@ -1,31 +1,81 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-from typing import cast
-from tkinter import PhotoImage
-from PIL import Image, ImageTk, ImageSequence
-import threading
-import requests
-from io import BytesIO
-from itinerario import (fetch_monuments_by_qid, plan_itinerary_by_popularity, find_city_candidates)
-from typing import Optional
-import re
-import unicodedata
-
-
-def load_image_from_url(url: str, size=(120, 120)):
-    print(f"Tentativo di caricamento immagine da URL: {url}")
-    headers = {
-        "User-Agent": "TRIPlanner/1.0 (offline educational use)"
-    }
+import time
+# Riferimento per il tempo alla prima finestra, preso prima degli altri import
+STARTED = time.perf_counter()
+
+import tkinter as tk  # noqa: E402
+from tkinter import ttk, messagebox, filedialog  # noqa: E402
+from tkinter import font as tkfont  # noqa: E402
+from typing import cast  # noqa: E402
+from tkinter import PhotoImage  # noqa: E402
+from PIL import Image, ImageTk, ImageSequence  # noqa: E402
+import bisect  # noqa: E402
+import os  # noqa: E402
+import threading  # noqa: E402
+import queue  # noqa: E402
+import cache  # noqa: E402
+import metriche  # noqa: E402
+from typing import Dict, Iterator, List, Optional  # noqa: E402
+import re  # noqa: E402
+import unicodedata  # noqa: E402
+
+# itinerario e immagini (requests, numpy, SPARQL) si importano al primo uso o in background dopo la prima finestra
+PRELOAD_DELAY_MS = 500
+
+SPLASH_GIF = "assets/globe.gif"
+SPLASH_SIZE = (250, 250)
+SPLASH_CACHE_DIR = os.path.join(cache.CACHE_DIR, "splash")
+# Fotogrammi convertiti in PhotoImage a ogni passo dell'animazione, per non bloccare il thread Tk
+SPLASH_FRAMES_PER_TICK = 4
+
+# Attesa dopo l'ultimo tasto prima di cercare i suggerimenti, e lunghezza minima del testo
+SUGGEST_DELAY_MS = 300
+SUGGEST_MIN_CHARS = 2
+SUGGEST_ROWS = 6
+# Stesso limite di gazetteer.MAX_RESULTS: il modulo (e unidecode) si importa solo al primo suggerimento
+SUGGEST_MAX_RESULTS = 20
+
+
+def _preload_modules():
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        img = Image.open(BytesIO(response.content))
-        img = img.resize(size, Image.Resampling.LANCZOS)
-        return cast(PhotoImage, ImageTk.PhotoImage(img))
+        import itinerario  # noqa: F401
+        import immagini  # noqa: F401
     except Exception as e:
-        messagebox.showerror("⚠️", f"Errore nel caricamento immagine:{e}")
-        return None
+        print(f"⚠️ Precaricamento dei moduli fallito: {e}")
+
+
+def iter_splash_frames(path: str = SPLASH_GIF, size=SPLASH_SIZE) -> Iterator[Image.Image]:
+    # Fotogrammi già ridimensionati dalla cache su disco; alla prima esecuzione si decodifica la GIF e si salvano
+    stat = os.stat(path)
+    frames_dir = os.path.join(SPLASH_CACHE_DIR, f"{os.path.basename(path)}-{size[0]}x{size[1]}-{stat.st_mtime_ns}")
+    marker = os.path.join(frames_dir, "count")
+    try:
+        with open(marker) as f:
+            count = int(f.read())
+        for i in range(count):
+            with Image.open(os.path.join(frames_dir, f"{i:03d}.png")) as img:
+                img.load()
+                yield img
+        return
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(frames_dir, exist_ok=True)
+    count = 0
+    with Image.open(path) as gif:
+        for frame in ImageSequence.Iterator(gif):
+            img = frame.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+            try:
+                img.save(os.path.join(frames_dir, f"{count:03d}.png"))
+            except OSError as e:
+                print(f"⚠️ Impossibile salvare i fotogrammi dell'animazione: {e}")
+            count += 1
+            yield img
+    # Il contatore si scrive per ultimo: una cache incompleta viene rigenerata
+    try:
+        with open(marker, "w") as f:
+            f.write(str(count))
+    except OSError:
+        pass
 
 
 def load_placeholder_image(size=(120, 120)):
@@ -54,27 +104,58 @@ class StartPage(tk.Frame):
 
         tk.Label(container, text="TRIPlanner", font=("Helvetica", 36, "bold"), bg="white").pack(pady=10)
 
-        try:
-            self.globe_gif = Image.open("assets/globe.gif")
-            self.frames_gif = [ImageTk.PhotoImage(img.resize((250, 250), Image.Resampling.LANCZOS))
-                               for img in ImageSequence.Iterator(self.globe_gif)]
-            self.globe_lbl = tk.Label(container, bg="white")
+        self.frames_gif = []
+        self._frame_queue = queue.Queue()
+        self._frames_done = False
+        if os.path.exists(SPLASH_GIF):
+            # Fotogrammi preparati in background e mostrati appena pronti
+            # Immagine vuota della stessa misura: il layout non cambia quando arriva il primo fotogramma
+            self._blank_frame = tk.PhotoImage(width=SPLASH_SIZE[0], height=SPLASH_SIZE[1])
+            self.globe_lbl = tk.Label(container, bg="white", image=self._blank_frame)
             self.globe_lbl.pack(pady=10)
+            threading.Thread(target=self._load_frames, daemon=True).start()
             self._animate()
-        except FileNotFoundError:
+        else:
             # File mancante: mostra solo il titolo senza animazione
             self.globe_lbl = tk.Label(container, text="TRIPlanner", font=("Helvetica", 24), bg="white")
             self.globe_lbl.pack(pady=10)
-            messagebox.showerror("⚠️", f"assets/globe.gif non trovato, salto animazione")
+            messagebox.showerror("⚠️", f"{SPLASH_GIF} non trovato, salto animazione")
 
         ttk.Button(container, text="Inizia il viaggio",
                    command=lambda: controller.show_frame("InputPage")).pack(pady=20)
 
+    def _load_frames(self):
+        try:
+            for img in iter_splash_frames():
+                self._frame_queue.put(img)
+        except Exception as e:
+            print(f"⚠️ Errore nel caricamento dell'animazione: {e}")
+        self._frame_queue.put(None)
+
     def _animate(self, idx=0):
+        # Solo la creazione delle PhotoImage avviene sul thread Tk, pochi fotogrammi per volta
+        for _ in range(SPLASH_FRAMES_PER_TICK):
+            try:
+                img = self._frame_queue.get_nowait()
+            except queue.Empty:
+                break
+            if img is None:
+                self._frames_done = True
+                metriche.observe("stage_seconds", time.perf_counter() - STARTED, stage="gui_splash_ready")
+                break
+            self.frames_gif.append(ImageTk.PhotoImage(img))
+
+        if not self.frames_gif:
+            if not self._frames_done:
+                self.after(20, self._animate, 0)
+            return
+        # Finché la decodifica non è finita si resta sull'ultimo fotogramma pronto
+        if idx >= len(self.frames_gif):
+            idx = 0 if self._frames_done else len(self.frames_gif) - 1
         frame = self.frames_gif[idx]
         self.globe_lbl.configure(image=cast(PhotoImage, frame))
         self.globe_lbl.image = frame
-        self.after(100, self._animate, (idx + 1) % len(self.frames_gif))
+        self.after(100, self._animate, idx + 1)
 
 
 class InputPage(tk.Frame):
@@ -106,14 +187,123 @@ class InputPage(tk.Frame):
         self.city_entry.grid(row=0, column=1, padx=10, pady=10)
         self._typing_timer = None
         self._last_city_input = ""
+        # Suggerimenti per testo normalizzato; ogni nuova ricerca rende obsolete quelle ancora in corso
+        self._suggestion_cache: Dict[str, List[Dict[str, str]]] = {}
+        self._suggestion_seq = 0
+        self._suggestions: List[Dict[str, str]] = []
+        self.suggestion_list = tk.Listbox(form, height=SUGGEST_ROWS, activestyle="dotbox", exportselection=False)
+        self.city_entry.bind("<KeyRelease>", self._on_city_typed)
+        self.city_entry.bind("<Down>", self._focus_suggestions)
+        self.city_entry.bind("<Escape>", lambda e: self._hide_suggestions())
+        self.suggestion_list.bind("<ButtonRelease-1>", self._on_suggestion_chosen)
+        self.suggestion_list.bind("<Return>", self._on_suggestion_chosen)
+        self.suggestion_list.bind("<Escape>", lambda e: (self._hide_suggestions(), self.city_entry.focus_set()))
         self.days_entry = ttk.Entry(form, width=10)
         self.days_entry.config(state="disabled")
         self.days_entry.grid(row=1, column=1, padx=10, pady=10, sticky="w")
 
         ttk.Button(container, text="Crea itinerario", command=self._on_create).pack(pady=20)
 
+    def _on_city_typed(self, event=None):
+        text = self.city_entry.get().strip()
+        if text == self._last_city_input:
+            return
+        self._last_city_input = text
+        # Il testo non corrisponde più alla città scelta dai suggerimenti
+        self.selected_qid = None
+        self.selected_city_name = None
+        self._suggestion_seq += 1
+        if self._typing_timer is not None:
+            self.after_cancel(self._typing_timer)
+            self._typing_timer = None
+        if len(" ".join(text.split())) < SUGGEST_MIN_CHARS:
+            self._hide_suggestions()
+            return
+        self._typing_timer = self.after(SUGGEST_DELAY_MS, self._request_suggestions, text, self._suggestion_seq)
+
+    def _cached_suggestions(self, query: str) -> Optional[List[Dict[str, str]]]:
+        from gazetteer import normalize
+
+        if query in self._suggestion_cache:
+            return self._suggestion_cache[query]
+        # Un testo più lungo restringe i risultati di un suo prefisso, se quelli non erano troncati
+        for end in range(len(query) - 1, SUGGEST_MIN_CHARS - 1, -1):
+            shorter = self._suggestion_cache.get(query[:end])
+            if shorter is not None and len(shorter) < SUGGEST_MAX_RESULTS:
+                filtered = [c for c in shorter if query in normalize(c.get("label") or "")]
+                if filtered:
+                    self._suggestion_cache[query] = filtered
+                    return filtered
+                return None
+        return None
+
+    def _request_suggestions(self, text: str, seq: int):
+        from gazetteer import normalize
+
+        self._typing_timer = None
+        query = normalize(text)
+        cached = self._cached_suggestions(query)
+        if cached is not None:
+            self._show_suggestions(cached)
+            return
+        threading.Thread(target=self._run_suggestion_thread, args=(text, query, seq), daemon=True).start()
+
+    def _run_suggestion_thread(self, text: str, query: str, seq: int):
+        try:
+            from itinerario import find_city_candidates
+            candidates = find_city_candidates(normalize_city_name(text))
+        except Exception as e:
+            print(f"⚠️ Suggerimenti non disponibili per '{text}': {e}")
+            return
+
+        def update_ui():
+            self._suggestion_cache[query] = candidates
+            # Risposta arrivata dopo altri tasti o dopo "Crea itinerario": si tiene solo in cache
+            if seq == self._suggestion_seq:
+                self._show_suggestions(candidates)
+
+        self.after(0, update_ui)
+
+    def _show_suggestions(self, candidates: List[Dict[str, str]]):
+        self._suggestions = candidates
+        self.suggestion_list.delete(0, tk.END)
+        for c in candidates:
+            self.suggestion_list.insert(tk.END, f"{c.get('label')} ({c.get('country') or 'Paese sconosciuto'})")
+        if not candidates:
+            self._hide_suggestions()
+            return
+        self.suggestion_list.config(height=min(SUGGEST_ROWS, len(candidates)))
+        self.suggestion_list.place(in_=self.city_entry, x=0, rely=1.0, relwidth=1.0)
+        self.suggestion_list.lift()
+
+    def _hide_suggestions(self):
+        self.suggestion_list.place_forget()
+
+    def _focus_suggestions(self, event=None):
+        if self._suggestions and self.suggestion_list.winfo_ismapped():
+            self.suggestion_list.focus_set()
+            self.suggestion_list.selection_clear(0, tk.END)
+            self.suggestion_list.selection_set(0)
+            self.suggestion_list.activate(0)
+        return "break"
+
+    def _on_suggestion_chosen(self, event=None):
+        selection = self.suggestion_list.curselection()
+        if not selection:
+            return
+        choice = self._suggestions[selection[0]]
+        self.selected_qid = choice["qid"]
+        self.selected_city_name = choice.get("label")
+        self._last_city_input = self.selected_city_name or ""
+        self._suggestion_seq += 1
+        self.city_entry.delete(0, tk.END)
+        self.city_entry.insert(0, self._last_city_input)
+        self._hide_suggestions()
+        self.days_entry.focus_set()
+
     def _run_city_lookup_thread(self, city):
         try:
+            from itinerario import find_city_candidates
             normalized_city = normalize_city_name(city)
             candidates = find_city_candidates(normalized_city)
         except Exception as e:
@@ -151,7 +341,7 @@ class InputPage(tk.Frame):
             messagebox.showerror("Input errato", "Inserisci un nome città valido.")
             return
 
-        if not re.match(r'^[a-zA-ZÀ-ÿ\s]+$', city):
+        if not self.selected_qid and not re.match(r'^[a-zA-ZÀ-ÿ\s]+$', city):
             messagebox.showerror("Input errato", "Il nome della città deve contenere solo lettere.")
             return
 
@@ -163,6 +353,8 @@ class InputPage(tk.Frame):
         self.temp_days = days
 
         self._disable_create_button()
+        self._suggestion_seq += 1
+        self._hide_suggestions()
 
         if self.selected_qid:
             self.controller.city = self.selected_city_name
@@ -197,6 +389,11 @@ class InputPage(tk.Frame):
         self.selected_qid = None
         self.selected_city_name = None
         self._last_city_input = ""
+        if self._typing_timer is not None:
+            self.after_cancel(self._typing_timer)
+            self._typing_timer = None
+        self._suggestion_seq += 1
+        self._hide_suggestions()
         self._city_selection_active = False
         self._city_lookup_active = False
         self._enable_create_button()
@@ -333,12 +530,39 @@ class LoadingPage(tk.Frame):
                  bg="#5f95b2", fg="white").pack(pady=50)
         self.bar = ttk.Progressbar(container, mode="indeterminate", length=400)
         self.bar.pack(pady=20)
+        self.status = tk.Label(container, text="", font=("Helvetica", 12), bg="#5f95b2", fg="white")
+        self.status.pack()
 
     def on_show(self):
+        self.bar.configure(mode="indeterminate", value=0)
+        self.status.configure(text="")
         self.bar.start(10)
 
+    def set_progress(self, done, total):
+        # Appena si conosce il numero di monumenti la barra diventa determinata
+        if str(self.bar.cget("mode")) != "determinate":
+            self.bar.stop()
+            self.bar.configure(mode="determinate")
+        self.bar.configure(maximum=max(total, 1), value=done)
+        self.status.configure(text=f"{done}/{total} monumenti")
+
 
 class ResultPage(tk.Frame):
+    # Altezze note prima di costruire le righe: permettono di sapere quali elementi cadono nella parte visibile.
+    # ROW_HEIGHT è il minimo di una riga; con descrizioni lunghe la riga cresce in base al testo misurato
+    DAY_HEIGHT = 60
+    EMPTY_HEIGHT = 40
+    ROW_HEIGHT = 150
+    # Margine (in pixel) oltre la parte visibile entro cui le righe vengono comunque costruite
+    OVERSCAN = 400
+    NAME_FONT = ("Helvetica", 14, "bold")
+    DESC_FONT = ("Helvetica", 11)
+    DESC_WRAP = 600
+    # Spazio verticale della riga oltre al testo: margini della riga, bordi delle etichette e distanza tra
+    # nome e descrizione
+    ROW_PADDING = 36
+    POLL_MS = 50
+
     def __init__(self, parent, controller):
         super().__init__(parent, bg="#3cb371")
         self.controller = controller
@@ -349,16 +573,13 @@ class ResultPage(tk.Frame):
         main_container = tk.Frame(self, bg="#3cb371")
         main_container.grid(row=0, column=0, sticky="nsew")
 
-        self.canvas = tk.Canvas(main_container, bg="#3cb371")
+        self.canvas = tk.Canvas(main_container, bg="#3cb371", highlightthickness=0)
         self.scroll_y = ttk.Scrollbar(main_container, orient="vertical", command=self.canvas.yview)
-        self.canvas.configure(yscrollcommand=self.scroll_y.set)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
 
         self.scroll_y.pack(side="right", fill="y")
         self.canvas.pack(side="left", fill="both", expand=True)
-
-        self.frame = tk.Frame(self.canvas, bg="#3cb371")
-        self.canvas.create_window((0, 0), window=self.frame, anchor="nw")
-        self.frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        self.canvas.bind("<Configure>", self._on_canvas_resize)
 
         self.bottom_btn_frame = tk.Frame(self, bg="#5f95b2")
         self.bottom_btn_frame.grid(row=1, column=0, sticky="nsew")
@@ -368,49 +589,333 @@ class ResultPage(tk.Frame):
                                    command=lambda: self.controller.show_frame("InputPage"))
         self.back_btn.pack(expand=True)
 
-    def on_show(self):
-        for child in self.frame.winfo_children():
-            child.destroy()
-
-        data = self.controller.itinerary_data or []
+        # Avanzamento del caricamento mentre si mostra un itinerario provvisorio
+        self.progress_frame = tk.Frame(self.bottom_btn_frame, bg="#5f95b2")
+        self.progress_label = tk.Label(self.progress_frame, text="", bg="#5f95b2", fg="white")
+        self.progress_label.pack(side="left", padx=(0, 5))
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode="determinate", length=200)
+        self.progress_bar.pack(side="left")
+
+        # Con virtualized=False tutte le righe vengono costruite subito (nessun riciclo)
+        self.virtualized = True
+        self._loader = None
+        self._placeholder = None
+        self._items = []
+        self._offsets = []
+        self._heights = []
+        self._total_height = 0
+        self._bound = {}
+        self._pool = {"day": [], "empty": [], "monument": []}
+        self._generation = 0
+        self._visibility_job = None
+        self._poll_job = None
+        self._fonts = None
+        self._desc_heights = {}
+        # Miniature delle righe visibili prima di un refresh, per QID: restano al loro posto senza ricaricarle
+        self._kept = {}
+
+    def _get_placeholder(self):
+        if self._placeholder is None:
+            image = load_placeholder_image()
+            self._placeholder = None if isinstance(image, Exception) else image
+        return self._placeholder
 
-        for idx, monuments in enumerate(data, start=1):
-            title = f"Giorno {idx}:"
-            tk.Label(self.frame, text=title, font=("Helvetica", 20, "bold"), bg="#3cb371") \
-                .pack(anchor="w", padx=30, pady=(20, 5))
+    def on_show(self):
+        self._render(keep_scroll=False)
+        self._start_polling()
+
+    def on_hide(self):
+        # Pagina nascosta: niente più controlli periodici né caricamenti in coda
+        self._stop_polling()
+        if self._visibility_job is not None:
+            self.after_cancel(self._visibility_job)
+            self._visibility_job = None
+        if self._loader is not None:
+            self._loader.cancel_all()
+        self._desc_heights = {}
+
+    def destroy(self):
+        self._stop_polling()
+        super().destroy()
+
+    def refresh(self):
+        self._render(keep_scroll=True)
+
+    def set_progress(self, done=None, total=None):
+        if done is None or done >= total:
+            self.progress_frame.pack_forget()
+            return
+        if not self.progress_frame.winfo_manager():
+            self.progress_frame.pack(side="left", padx=20, before=self.back_btn)
+        self.progress_bar.configure(maximum=max(total, 1), value=done)
+        self.progress_label.configure(text=f"Itinerario provvisorio: {done}/{total} monumenti")
+
+    def _render(self, keep_scroll):
+        position = self.canvas.yview()[0]
+        self.loader.cancel_all()
+        self._generation += 1
+        if keep_scroll:
+            self._kept = {w["qid"]: (w["url"], w["image"].image) for w in self._bound.values()
+                          if w["kind"] == "monument" and w.get("loaded") is not None and w.get("qid")}
+        for idx in list(self._bound):
+            self._release(idx)
+
+        self._items = []
+        self._offsets = []
+        self._heights = []
+        y = 0
+        itinerary = self.controller.itinerary_data or []
+        sections = [(f"Giorno {idx}:", monuments) for idx, monuments in enumerate(itinerary, start=1)]
+        # Candidati rimasti fuori dai giorni (già limitati da itinerario.RESERVE_SIZE): alternative se avanza tempo
+        reserve = getattr(itinerary, "reserve", [])
+        if reserve:
+            sections.append(("Se avanza tempo:", reserve))
+        for title, monuments in sections:
+            day_items = [("day", title)]
+            day_items += [("monument", m) for m in monuments] if monuments else [("empty", None)]
+            for kind, payload in day_items:
+                height = self._item_height(kind, payload)
+                self._items.append((kind, payload))
+                self._offsets.append(y)
+                self._heights.append(height)
+                y += height
+        self._total_height = y
+
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self._total_height))
+        self.canvas.yview_moveto(position if keep_scroll else 0)
+        if keep_scroll:
+            # Le righe vengono ricostruite subito, nello stesso passo in cui sono state nascoste: nessuno sfarfallio
+            if self._visibility_job is not None:
+                self.after_cancel(self._visibility_job)
+                self._visibility_job = None
+            self._update_visibility()
+            self._kept = {}
+        else:
+            self._schedule_visibility_update()
+
+    def _item_height(self, kind, payload=None):
+        if kind == "monument":
+            desc = (payload or {}).get("description") or "Descrizione non disponibile."
+            return max(self.ROW_HEIGHT, self._text_height(desc))
+        return {"day": self.DAY_HEIGHT, "empty": self.EMPTY_HEIGHT}[kind]
+
+    def _text_height(self, desc):
+        # Stesso a capo dell'etichetta (wraplength in pixel, per parole), calcolato una volta per testo
+        height = self._desc_heights.get(desc)
+        if height is not None:
+            return height
+        if self._fonts is None:
+            self._fonts = (tkfont.Font(self, font=self.NAME_FONT), tkfont.Font(self, font=self.DESC_FONT))
+        name_font, desc_font = self._fonts
+        lines = 0
+        for paragraph in desc.split("\n"):
+            lines += 1
+            width = 0
+            for word in paragraph.split(" "):
+                word_width = desc_font.measure(word + " ")
+                if width and width + word_width > self.DESC_WRAP:
+                    lines += 1
+                    width = 0
+                width += word_width
+        height = self.ROW_PADDING + name_font.metrics("linespace") + lines * desc_font.metrics("linespace")
+        self._desc_heights[desc] = height
+        return height
+
+    def _create_widget(self, kind):
+        frame = tk.Frame(self.canvas, bg="#3cb371", height=self._item_height(kind))
+        frame.pack_propagate(False)
+        widget = {"kind": kind, "frame": frame}
+
+        if kind == "day":
+            widget["title"] = tk.Label(frame, font=("Helvetica", 20, "bold"), bg="#3cb371")
+            widget["title"].pack(anchor="w", padx=30, pady=(20, 5))
+        elif kind == "empty":
+            tk.Label(frame, text="Nessun risultato trovato.",
+                     font=("Helvetica", 12, "italic"), bg="#3cb371", fg="gray").pack(anchor="w", padx=50,
+                                                                                     pady=(0, 10))
+        else:
+            row = tk.Frame(frame, bg="#3cb371")
+            row.pack(fill="both", expand=True, padx=50, pady=10)
+
+            image = self._get_placeholder()
+            widget["image"] = tk.Label(row, image=image, bg="#3cb371", width=120, height=120)
+            widget["image"].image = image
+            widget["image"].pack(side="left", padx=(0, 15))
+
+            details = tk.Frame(row, bg="#3cb371")
+            details.pack(side="left", fill="both", expand=True)
+
+            widget["name"] = tk.Label(details, font=self.NAME_FONT, bg="#3cb371")
+            widget["name"].pack(anchor="w")
+            widget["desc"] = tk.Label(details, wraplength=self.DESC_WRAP, justify="left", bg="#3cb371",
+                                      font=self.DESC_FONT)
+            widget["desc"].pack(anchor="w", pady=(5, 0))
+
+        widget["window"] = self.canvas.create_window(0, 0, window=frame, anchor="nw", state="hidden",
+                                                     width=self.canvas.winfo_width(),
+                                                     height=self._item_height(kind))
+        return widget
+
+    def _bind(self, idx):
+        kind, payload = self._items[idx]
+        pool = self._pool[kind]
+        widget = pool.pop() if pool else self._create_widget(kind)
+
+        if kind == "day":
+            widget["title"].configure(text=payload)
+        elif kind == "monument":
+            widget["name"].configure(text=payload.get("label", "Sconosciuto"))
+            widget["desc"].configure(text=payload.get("description") or "Descrizione non disponibile.")
+            widget["frame"].configure(height=self._heights[idx])
+            self.canvas.itemconfigure(widget["window"], height=self._heights[idx])
+            widget["qid"], widget["url"] = payload.get("qid"), payload.get("image")
+            kept = self._kept.get(widget["qid"])
+            if kept and kept[0] == widget["url"]:
+                widget["image"].configure(image=kept[1])
+                widget["image"].image = kept[1]
+                widget["loaded"] = idx
+
+        self.canvas.coords(widget["window"], 0, self._offsets[idx])
+        self.canvas.itemconfigure(widget["window"], state="normal")
+        self._bound[idx] = widget
+
+    def _release(self, idx):
+        widget = self._bound.pop(idx)
+        widget["loaded"] = None
+        self.canvas.itemconfigure(widget["window"], state="hidden")
+        if widget["kind"] == "monument":
+            # La PhotoImage fuori schermo viene rilasciata; la miniatura resta nella cache in memoria
+            self.loader.cancel((self._generation, idx))
+            placeholder = self._get_placeholder()
+            widget["image"].configure(image=placeholder)
+            widget["image"].image = placeholder
+        self._pool[widget["kind"]].append(widget)
+
+    def _on_canvas_resize(self, event):
+        for widget in list(self._bound.values()) + [w for pool in self._pool.values() for w in pool]:
+            self.canvas.itemconfigure(widget["window"], width=event.width)
+        self.canvas.configure(scrollregion=(0, 0, event.width, self._total_height))
+        self._schedule_visibility_update()
+
+    def _on_scroll(self, first, last):
+        self.scroll_y.set(first, last)
+        self._schedule_visibility_update()
+
+    def _schedule_visibility_update(self):
+        if self._visibility_job is None:
+            self._visibility_job = self.after(30, self._update_visibility)
+
+    def _update_visibility(self):
+        self._visibility_job = None
+        if not self._items:
+            return
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
 
-            if not monuments:
-                tk.Label(self.frame, text="Nessun risultato trovato.",
-                         font=("Helvetica", 12, "italic"), bg="#3cb371", fg="gray").pack(anchor="w", padx=50,
-                                                                                         pady=(0, 10))
+        if self.virtualized:
+            first = max(0, bisect.bisect_right(self._offsets, top - self.OVERSCAN) - 1)
+            last = bisect.bisect_left(self._offsets, bottom + self.OVERSCAN)
+        else:
+            first, last = 0, len(self._items)
+        wanted = range(first, last)
+
+        for idx in list(self._bound):
+            if idx not in wanted:
+                self._release(idx)
+        for idx in wanted:
+            if idx not in self._bound:
+                self._bind(idx)
+
+        for idx in wanted:
+            kind, monument = self._items[idx]
+            widget = self._bound[idx]
+            if kind != "monument" or not monument.get("image") or widget.get("loaded") == idx:
                 continue
-
-            for monument in monuments:
-                name = monument.get("label", "Sconosciuto")
-                img_url = monument.get("image")
-
-                row = tk.Frame(self.frame, bg="#3cb371")
-                row.pack(fill="x", padx=50, pady=10)
-
-                image = load_image_from_url(img_url) if img_url else None
-                if not image:
-                    image = load_placeholder_image()
-
-                image_label = tk.Label(row, image=image, bg="#3cb371", width=120, height=120)
-                image_label.image = image
-                image_label.pack(side="left", padx=(0, 15))
-
-                details = tk.Frame(row, bg="#3cb371")
-                details.pack(side="left", fill="both", expand=True)
-
-                tk.Label(details, text=name, font=("Helvetica", 14, "bold"), bg="#3cb371").pack(anchor="w")
-
-                desc = monument.get("description", "Descrizione non disponibile.")
-                tk.Label(details, text=desc, wraplength=600, justify="left", bg="#3cb371", font=("Helvetica", 11)) \
-                    .pack(anchor="w", pady=(5, 0))
+            row_top = self._offsets[idx]
+            # Distanza dalla parte visibile: 0 per le righe a schermo, che hanno la precedenza
+            distance = max(0, top - (row_top + self._heights[idx]), row_top - bottom)
+            self.loader.request((self._generation, idx), monument["image"], priority=distance)
+
+    @property
+    def loader(self):
+        if self._loader is None:
+            from immagini import ImageLoader
+            self._loader = ImageLoader()
+        return self._loader
+
+    def _start_polling(self):
+        if self._poll_job is None:
+            self._poll_job = self.after(self.POLL_MS, self._poll_images)
+
+    def _stop_polling(self):
+        if self._poll_job is not None:
+            self.after_cancel(self._poll_job)
+            self._poll_job = None
+
+    def _poll_images(self):
+        self._poll_job = None
+        try:
+            while self._loader is not None:
+                (generation, idx), img, error = self._loader.results.get_nowait()
+                if generation != self._generation or idx not in self._bound:
+                    continue
+                widget = self._bound[idx]
+                widget["loaded"] = idx
+                if img is None:
+                    print(f"⚠️ Errore nel caricamento immagine {self._items[idx][1].get('image')}: {error}")
+                    continue
+                # Solo la creazione della PhotoImage avviene sul thread Tk
+                photo = cast(PhotoImage, ImageTk.PhotoImage(img))
+                widget["image"].configure(image=photo)
+                widget["image"].image = photo
+        except queue.Empty:
+            pass
+        self._start_polling()
+
+
+class DebugPanel(tk.Toplevel):
+    # Finestra con tempi per fase, richieste per host e cache; si apre e chiude con F12
+    REFRESH_MS = 1000
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("TRIPlanner - metriche")
+        self.geometry("640x480")
+
+        buttons = tk.Frame(self)
+        buttons.pack(side="bottom", fill="x")
+        tk.Button(buttons, text="Esporta JSON", command=lambda: self._export(metriche.to_json, ".json")).pack(
+            side="left", padx=5, pady=5)
+        tk.Button(buttons, text="Esporta Prometheus",
+                  command=lambda: self._export(metriche.to_prometheus, ".prom")).pack(side="left", padx=5, pady=5)
+        tk.Button(buttons, text="Azzera", command=metriche.reset).pack(side="right", padx=5, pady=5)
+
+        self.text = tk.Text(self, font=("Courier", 10), wrap="none")
+        self.text.pack(fill="both", expand=True)
+        self._refresh()
+
+    def _refresh(self):
+        if not self.winfo_exists():
+            return
+        top = self.text.yview()[0]
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", metriche.to_text())
+        self.text.configure(state="disabled")
+        self.text.yview_moveto(top)
+        self.after(self.REFRESH_MS, self._refresh)
+
+    def _export(self, render, extension):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=extension,
+                                            initialfile=f"triplanner-metriche{extension}")
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(render())
 
 
 class TriPlannerApp(tk.Tk):
+    PROVISIONAL_PLAN_INTERVAL = 0.5
+
     def __init__(self):
         super().__init__()
         self.title("TRIPlanner")
@@ -420,6 +925,10 @@ class TriPlannerApp(tk.Tk):
         self.city = None
         self.days = None
         self.itinerary_data = None
+        self.current_frame = None
+        self._fetch_id = 0
+        self._debug_panel = None
+        self.bind("<F12>", lambda e: self.toggle_debug_panel())
 
         self._container = tk.Frame(self)
         self._container.pack(fill="both", expand=True)
@@ -433,8 +942,24 @@ class TriPlannerApp(tk.Tk):
             frame.grid(row=0, column=0, sticky="nsew")
 
         self.show_frame("StartPage")
+        self.after_idle(self._on_first_paint)
+
+    def _on_first_paint(self):
+        metriche.observe("stage_seconds", time.perf_counter() - STARTED, stage="gui_first_paint")
+        self.after(PRELOAD_DELAY_MS, lambda: threading.Thread(target=_preload_modules, daemon=True).start())
+
+    def toggle_debug_panel(self):
+        if self._debug_panel is not None and self._debug_panel.winfo_exists():
+            self._debug_panel.destroy()
+            self._debug_panel = None
+        else:
+            self._debug_panel = DebugPanel(self)
 
     def show_frame(self, name):
+        previous = self.frames.get(self.current_frame)
+        if previous is not None and previous is not self.frames[name] and hasattr(previous, "on_hide"):
+            previous.on_hide()
+        self.current_frame = name
         frame = self.frames[name]
         frame.tkraise()
         if hasattr(frame, "on_show"):
@@ -448,6 +973,7 @@ class TriPlannerApp(tk.Tk):
 
     def _generate_itinerary(self):
         try:
+            from itinerario import find_city_candidates
             candidates = find_city_candidates(self.city)
             if not candidates:
                 raise ValueError("Nessuna città trovata.")
@@ -458,18 +984,66 @@ class TriPlannerApp(tk.Tk):
             self.show_frame("ResultPage")
 
     def fetch_and_generate_from_qid(self, qid):
+        self._fetch_id += 1
+        fetch_id = self._fetch_id
+        days = self.days
+
         def worker():
+            from itinerario import fetch_monument_rows, iter_enriched_monuments, plan_itinerary_by_distance
+            monuments = {}
+            plan = [[] for _ in range(days)]
+            last_plan = 0.0
+            started = time.perf_counter()
             try:
-                monuments = fetch_monuments_by_qid(qid, limit=60)
-                self.itinerary_data = plan_itinerary_by_popularity(monuments, self.days)
+                rows = fetch_monument_rows(qid, limit=60)
+                if rows.partial:
+                    self.after(0, lambda: messagebox.showwarning(
+                        "⚠️", "Alcune categorie di monumenti non sono state caricate: "
+                              "l'itinerario potrebbe essere incompleto."))
+                for idx, monument, done, total in iter_enriched_monuments(rows):
+                    if not monuments:
+                        metriche.observe("stage_seconds", time.perf_counter() - started, stage="gui_first_result")
+                    monuments[idx] = monument
+                    now = time.monotonic()
+                    if done < total and now - last_plan < self.PROVISIONAL_PLAN_INTERVAL:
+                        self.after(0, lambda d=done, t=total: self._on_fetch_progress(fetch_id, d, t, None))
+                        continue
+                    # Itinerario provvisorio ricalcolato al più ogni PROVISIONAL_PLAN_INTERVAL secondi
+                    last_plan = now
+                    plan = plan_itinerary_by_distance([monuments[i] for i in sorted(monuments)], days)
+                    self.after(0, lambda p=plan, d=done, t=total: self._on_fetch_progress(fetch_id, d, t, p))
             except Exception as e:
                 messagebox.showerror("⚠️", f"Errore nel fetch dei monumenti:{e}")
-                self.itinerary_data = [[] for _ in range(self.days)]
             finally:
-                self.after(0, lambda: self.show_frame("ResultPage"))
+                metriche.observe("stage_seconds", time.perf_counter() - started, stage="gui_total")
+                self.after(0, lambda: self._on_fetch_complete(fetch_id, plan))
 
         threading.Thread(target=worker, daemon=True).start()
 
+    def _on_fetch_progress(self, fetch_id, done, total, plan):
+        if fetch_id != self._fetch_id:
+            return
+        self.frames["LoadingPage"].set_progress(done, total)
+        self.frames["ResultPage"].set_progress(done, total)
+        if plan is None:
+            return
+        self.itinerary_data = plan
+        if self.current_frame == "LoadingPage":
+            self.show_frame("ResultPage")
+        elif self.current_frame == "ResultPage":
+            self.frames["ResultPage"].refresh()
+
+    def _on_fetch_complete(self, fetch_id, plan):
+        if fetch_id != self._fetch_id:
+            return
+        self.frames["ResultPage"].set_progress()
+        changed = plan is not self.itinerary_data
+        self.itinerary_data = plan
+        if self.current_frame == "LoadingPage":
+            self.show_frame("ResultPage")
+        elif self.current_frame == "ResultPage" and changed:
+            self.frames["ResultPage"].refresh()
+
 
 if __name__ == "__main__":
     app = TriPlannerApp()
@@ -0,0 +1,293 @@
+import hashlib
+import itertools
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Hashable, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from PIL import Image, ImageOps
+import requests
+
+import cache
+import metriche
+import rete
+
+IMAGE_HEADERS = {"User-Agent": "TRIPlanner/1.0 (offline educational use)"}
+THUMB_SIZE = (120, 120)
+DEFAULT_LOADER_WORKERS = 4
+
+# Larghezze standard delle miniature Wikimedia: sono già in cache lato server
+THUMB_WIDTHS = (120, 250, 330, 500, 960, 1280)
+MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+DISK_CACHE_BYTES = 200 * 1024 * 1024
+THUMB_DIR = os.path.join(cache.CACHE_DIR, "thumbs")
+
+_UPLOAD_RE = re.compile(r"^(https?://upload\.wikimedia\.org/[^/]+/[^/]+)/(thumb/)?([0-9a-f]/[0-9a-f]{2})/([^/]+)(/.*)?$")
+
+
+def _thumb_width(size: Tuple[int, int]) -> int:
+    # Larghezza doppia rispetto al lato maggiore: il ritaglio quadrato resta nitido anche per le foto orizzontali
+    wanted = max(size) * 2
+    for width in THUMB_WIDTHS:
+        if width >= wanted:
+            return width
+    return THUMB_WIDTHS[-1]
+
+
+def thumbnail_url(url: str, size: Tuple[int, int] = THUMB_SIZE) -> str:
+    width = _thumb_width(size)
+    parts = urlsplit(url)
+    if parts.netloc.endswith("wikimedia.org") and "/Special:FilePath/" in parts.path:
+        filename = parts.path.split("/Special:FilePath/", 1)[1]
+        return rete.commons_url(f"/wiki/Special:FilePath/{filename}?width={width}")
+    match = _UPLOAD_RE.match(url)
+    if match:
+        base, _, shard, filename, _ = match.groups()
+        name = unquote(filename)
+        thumb_name = f"{width}px-{name}"
+        if name.lower().endswith((".svg", ".tif", ".tiff")):
+            thumb_name += ".png" if name.lower().endswith(".svg") else ".jpg"
+        return f"{base}/thumb/{shard}/{filename}/{quote(thumb_name)}"
+    return url
+
+
+class MemoryImageCache:
+    # LRU delle immagini già decodificate, limitata dalla memoria occupata dai pixel
+    def __init__(self, max_bytes: int = MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cost(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+            return img
+
+    def put(self, key: Hashable, img: Image.Image):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._total -= self._cost(old)
+            self._items[key] = img
+            self._total += self._cost(img)
+            while self._total > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._total -= self._cost(evicted)
+
+
+class DiskThumbnailCache:
+    # Miniature codificate salvate per hash del contenuto; un indice SQLite associa URL e hash
+    def __init__(self, directory: str = THUMB_DIR, max_bytes: int = DISK_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS thumbs (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        # Spazio occupato, aggiornato a ogni inserimento e rimozione invece di ricalcolarlo sull'intera tabella
+        self._total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM thumbs)").fetchone()[0]
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM thumbs WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._path(row[0]), "rb") as f:
+                    data = f.read()
+            except OSError:
+                self._remove(url)
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE thumbs SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+            return data
+
+    def put(self, url: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            row = self._conn.execute("SELECT digest FROM thumbs WHERE url = ?", (url,)).fetchone()
+            if row is not None and row[0] == digest:
+                self._conn.execute("UPDATE thumbs SET last_access = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+                return
+            self._remove(url)
+            # Lo spazio si conta per contenuto: più URL con la stessa miniatura occupano un solo file
+            if not self._in_use(digest):
+                self._total += len(data)
+            self._conn.execute("INSERT INTO thumbs VALUES (?, ?, ?, ?)", (url, digest, len(data), time.time()))
+            if self._total > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _in_use(self, digest: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM thumbs WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None
+
+    def _remove(self, url: str):
+        # Toglie l'URL dall'indice; il file si cancella quando nessun altro URL lo usa
+        row = self._conn.execute("SELECT digest, size FROM thumbs WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return
+        digest, size = row
+        self._conn.execute("DELETE FROM thumbs WHERE url = ?", (url,))
+        if not self._in_use(digest):
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+            self._total -= size
+
+    def _evict(self):
+        for (url,) in self._conn.execute("SELECT url FROM thumbs ORDER BY last_access").fetchall():
+            self._remove(url)
+            if self._total <= self.max_bytes * 0.9:
+                break
+
+
+_memory_cache = MemoryImageCache()
+_disk_cache: Optional[DiskThumbnailCache] = None
+_disk_lock = threading.Lock()
+
+
+def _get_disk_cache() -> DiskThumbnailCache:
+    global _disk_cache
+    with _disk_lock:
+        if _disk_cache is None:
+            _disk_cache = DiskThumbnailCache()
+        return _disk_cache
+
+
+def _download(url: str) -> bytes:
+    response = rete.get(url, headers=IMAGE_HEADERS, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+
+def _fetch_encoded(url: str, size: Tuple[int, int]) -> bytes:
+    thumb = thumbnail_url(url, size)
+    disk = _get_disk_cache() if cache.get_mode() != "bypass" else None
+    if disk is not None and cache.get_mode() == "use":
+        data = disk.get(thumb)
+        if data is not None:
+            metriche.incr("image_loads_total", source="disk")
+            return data
+    metriche.incr("image_loads_total", source="network")
+    try:
+        data = _download(thumb)
+    except requests.HTTPError:
+        if thumb == url:
+            raise
+        # Miniatura non disponibile (ad esempio file più piccolo della larghezza richiesta)
+        data = _download(url)
+    if disk is not None:
+        disk.put(thumb, data)
+    return data
+
+
+def fetch_image(url: str, size: Tuple[int, int] = THUMB_SIZE) -> Image.Image:
+    key = (url, size)
+    img = _memory_cache.get(key)
+    if img is not None:
+        metriche.incr("image_loads_total", source="memory")
+        return img
+    with metriche.timer("image_load_seconds"):
+        img = Image.open(BytesIO(_fetch_encoded(url, size)))
+        # Per i JPEG la decodifica avviene già a una scala ridotta vicina alla miniatura
+        img.draft("RGB", size)
+        img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+    _memory_cache.put(key, img)
+    return img
+
+
+class _Job:
+    __slots__ = ("key", "url", "size", "priority", "cancelled")
+
+    def __init__(self, key, url, size, priority):
+        self.key = key
+        self.url = url
+        self.size = size
+        self.priority = priority
+        self.cancelled = False
+
+
+class ImageLoader:
+    # Scarica, decodifica e ridimensiona le immagini su thread in background.
+    # I risultati (PIL, non PhotoImage) finiscono in `results` e vanno consumati dal thread Tk.
+    def __init__(self, workers: int = DEFAULT_LOADER_WORKERS):
+        self.results: "queue.Queue[Tuple[Hashable, Optional[Image.Image], Optional[Exception]]]" = queue.Queue()
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"immagini-{i}", daemon=True).start()
+
+    def request(self, key: Hashable, url: str, size: Tuple[int, int] = THUMB_SIZE, priority: float = 0):
+        with self._lock:
+            old = self._jobs.get(key)
+            if old is not None:
+                if old.priority == priority:
+                    return
+                old.cancelled = True
+            job = _Job(key, url, size, priority)
+            self._jobs[key] = job
+        self._queue.put((priority, next(self._counter), job))
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job is not None:
+                job.cancelled = True
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancelled = True
+            self._jobs.clear()
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job.cancelled:
+                continue
+            try:
+                img, error = fetch_image(job.url, job.size), None
+            except Exception as e:
+                img, error = None, e
+            with self._lock:
+                if job.cancelled or self._jobs.get(job.key) is not job:
+                    continue
+                del self._jobs[job.key]
+            self.results.put((job.key, img, error))
@@ -1,35 +1,69 @@
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import time
 import requests
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
 
-HEADERS = {"User-Agent": "TRIPlanner/1.0 (for academic use)"}
+import cache
+import metriche
+import rete
+from monumento import NO_DESCRIPTION, NO_SOURCE, Monument, intern_source
+
+HEADERS = rete.HEADERS
+
+# Titoli per richiesta multipla all'API MediaWiki (il massimo di TextExtracts è 20)
+BATCH_SIZE = 20
+
+# Stime iniziali per le sorgenti non ancora misurate, pesate come PRIOR_WEIGHT osservazioni
+PRIOR_HIT_RATE = 0.5
+PRIOR_LATENCY = 0.3
+PRIOR_WEIGHT = 5
 
 
 def extract_description(binding):
-    desc_it, desc_en = "", ""
+    desc_it = binding.get("descriptionIt", {}).get("value", "")
+    desc_en = binding.get("descriptionEn", {}).get("value", "")
     if "description" in binding:
         lang = binding["description"].get("xml:lang")
         text = binding["description"]["value"]
         if lang == "it":
-            desc_it = text
+            desc_it = desc_it or text
         elif lang == "en":
-            desc_en = text
+            desc_en = desc_en or text
     return desc_it or desc_en or ""
 
 
+def extract_sitelinks(binding) -> Dict[str, str]:
+    titles = {}
+    for lang in ["it", "en"]:
+        title = binding.get(f"{lang}Title", {}).get("value")
+        if title:
+            titles[lang] = title
+    return titles
+
+
 def assign_source(data, fallback_data, source_name):
     if not data and fallback_data:
-        return fallback_data, source_name
+        return fallback_data, intern_source(source_name)
     if data:
-        return data, source_name
-    return data, "Nessuna"
+        return data, intern_source(source_name)
+    return data, NO_SOURCE
 
 
 def _fetch_wikipedia_summary(title: str, lang: str) -> Dict[str, str]:
+    # Titoli e ricerche senza risultato restano segnati nella cache HTTP (cache.mark_missing)
+    if cache.is_missing("summary", lang, title):
+        return {}
     try:
-        endpoint = f"https://{lang}.wikipedia.org/api/rest_v1/page/summary/{title.replace(' ', '_')}"
-        res = requests.get(endpoint, headers=HEADERS, timeout=5)
-        res.raise_for_status()
-        js = res.json()
+        endpoint = rete.wikipedia_url(lang, f"/api/rest_v1/page/summary/{title.replace(' ', '_')}")
+        with metriche.timer("enrichment_call_seconds", call="summary", lang=lang):
+            js = rete.get_json(endpoint, headers=HEADERS, timeout=5)
+        if js is None:
+            cache.mark_missing("summary", lang, title)
+        if not js:
+            return {}
+        cache.forget_missing("summary", lang, title)
         return {
             "description": js.get("extract"),
             "image": js.get("thumbnail", {}).get("source")
@@ -39,13 +73,18 @@ def _fetch_wikipedia_summary(title: str, lang: str) -> Dict[str, str]:
 
 
 def _search_and_fetch_wikipedia(label: str, lang: str) -> Dict[str, str]:
+    if cache.is_missing("search", lang, label):
+        return {}
     try:
-        search_url = f"https://{lang}.wikipedia.org/w/api.php"
+        search_url = rete.wikipedia_url(lang, "/w/api.php")
         params = {"action": "query", "list": "search", "srsearch": label, "format": "json"}
-        res = requests.get(search_url, params=params, headers=HEADERS, timeout=5)
-        res.raise_for_status()
-        results = res.json().get("query", {}).get("search", [])
+        with metriche.timer("enrichment_call_seconds", call="search", lang=lang):
+            js = rete.get_json(search_url, params=params, headers=HEADERS, timeout=5,
+                               is_empty=lambda r: not r.get("query", {}).get("search"))
+        results = (js or {}).get("query", {}).get("search", [])
         if not results:
+            if js is not None:
+                cache.mark_missing("search", lang, label)
             return {}
         best_title = results[0]["title"]
         return _fetch_wikipedia_summary(best_title, lang)
@@ -53,57 +92,310 @@ def _search_and_fetch_wikipedia(label: str, lang: str) -> Dict[str, str]:
         return {}
 
 
+def _fetch_commons_image(label: str) -> Dict[str, str]:
+    if cache.is_missing("commons", "", label):
+        return {}
+    commons_url = rete.commons_url("/w/api.php")
+    params = {"action": "query", "titles": label, "prop": "pageimages",
+              "pithumbsize": 600, "format": "json"}
+    try:
+        with metriche.timer("enrichment_call_seconds", call="commons"):
+            js = rete.get_json(commons_url, params=params, headers=HEADERS, timeout=5)
+    except (requests.RequestException, ValueError):
+        return {}
+    pages = (js or {}).get("query", {}).get("pages", {})
+    for p in pages.values():
+        if "thumbnail" in p and "source" in p["thumbnail"]:
+            return {"image": p["thumbnail"]["source"]}
+    if js is not None and all("missing" in p for p in pages.values()):
+        cache.mark_missing("commons", "", label)
+    return {}
+
+
+def _fill_missing(data: Dict, js: Dict, source_name: str) -> bool:
+    filled = False
+    for field in ("description", "image"):
+        if not data[field] and js.get(field):
+            data[field], data[f"{field}_source"] = assign_source(data[field], js[field], source_name)
+            filled = True
+    return filled
+
+
 def _update_if_missing(data: Dict, js: Dict, lang: str, source_prefix: str):
-    if not data["description"] and js.get("description"):
-        data["description"], data["description_source"] = assign_source(
-            data["description"], js["description"], f"{source_prefix}-{lang}"
-        )
-    if not data["image"] and js.get("image"):
-        data["image"], data["image_source"] = assign_source(
-            data["image"], js["image"], f"{source_prefix}-{lang}"
-        )
+    _fill_missing(data, js, f"{source_prefix}-{lang}")
 
 
-def get_monument_data(label: str, desc: str = None, img: str = None) -> Dict[str, str]:
-    data = dict(
-        label=label,
-        description=None,
-        description_source="Nessuna",
-        image=None,
-        image_source="Nessuna"
-    )
+def _new_record(label: str, desc: str = None, img: str = None, qid: str = None) -> Monument:
+    data = Monument(qid=qid, label=label)
 
     data["description"], data["description_source"] = assign_source(desc, None, "Wikidata")
     data["image"], data["image_source"] = assign_source(img, None, "Wikidata")
+    return data
 
-    for lang in ["it", "en"]:
-        js = _fetch_wikipedia_summary(label, lang)
-        _update_if_missing(data, js, lang, "Wikipedia-summary")
 
-    for lang in ["it", "en"]:
-        js = _search_and_fetch_wikipedia(label, lang)
-        _update_if_missing(data, js, lang, "Wikipedia-search")
+def is_complete(data: Dict) -> bool:
+    return bool(data["description"]) and bool(data["image"])
 
-    if not data["image"]:
-        commons_url = "https://commons.wikimedia.org/w/api.php"
-        params = {"action": "query", "titles": label, "prop": "pageimages",
-                  "pithumbsize": 600, "format": "json"}
-        try:
-            res = requests.get(commons_url, params=params, headers=HEADERS, timeout=5)
-            res.raise_for_status()
-            pages = res.json().get("query", {}).get("pages", {})
-            for p in pages.values():
-                if "thumbnail" in p and "source" in p["thumbnail"]:
-                    data["image"], data["image_source"] = assign_source(
-                        data["image"], p["thumbnail"]["source"], "Wikimedia Commons"
-                    )
-                    break
-        except requests.RequestException:
-            pass
 
+def _missing_fields(data: Dict) -> Tuple[str, ...]:
+    return tuple(f for f in ("description", "image") if not data[f])
+
+
+class EnrichmentSource(ABC):
+    # Una sorgente della catena: quali campi può fornire, quando ha senso interrogarla e come
+    name = ""
+    fields: Tuple[str, ...] = ("description", "image")
+    # Livello di qualità della descrizione (titolo esatto, ricerca, Commons): dentro lo stesso livello
+    # decide il costo misurato
+    preference = 0
+
+    def __init__(self, lang: Optional[str] = None):
+        self.lang = lang
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.attempts = 0
+            self.hits = 0
+            self.seconds = 0.0
+
+    def applicable(self, data: Dict, titles: Dict[str, str], search: bool) -> bool:
+        return True
+
+    @abstractmethod
+    def fetch(self, data: Dict, titles: Dict[str, str]) -> Dict[str, str]:
+        pass
+
+    def record(self, hit: bool, seconds: float):
+        with self._lock:
+            self.attempts += 1
+            self.hits += hit
+            self.seconds += seconds
+
+    def score(self) -> float:
+        # Campi attesi per secondo, con una stima iniziale finché mancano misure
+        with self._lock:
+            hit_rate = (self.hits + PRIOR_HIT_RATE * PRIOR_WEIGHT) / (self.attempts + PRIOR_WEIGHT)
+            latency = (self.seconds + PRIOR_LATENCY * PRIOR_WEIGHT) / (self.attempts + PRIOR_WEIGHT)
+        return hit_rate / max(latency, 1e-3)
+
+
+class SummarySource(EnrichmentSource):
+    preference = 0
+
+    def __init__(self, lang: str):
+        super().__init__(lang)
+        self.name = f"Wikipedia-summary-{lang}"
+
+    def _title(self, data: Dict, titles: Dict[str, str]) -> str:
+        return titles.get(self.lang, data["label"])
+
+    def applicable(self, data, titles, search):
+        # Con i sitelink si usa solo il titolo esatto; senza, il label come titolo
+        if titles and self.lang not in titles:
+            return False
+        return not cache.is_missing("summary", self.lang, self._title(data, titles))
+
+    def fetch(self, data, titles):
+        return _fetch_wikipedia_summary(self._title(data, titles), self.lang)
+
+
+class SearchSource(EnrichmentSource):
+    preference = 1
+
+    def __init__(self, lang: str):
+        super().__init__(lang)
+        self.name = f"Wikipedia-search-{lang}"
+
+    def applicable(self, data, titles, search):
+        # La ricerca per testo serve solo se Wikidata non ha un collegamento a Wikipedia
+        return search and not cache.is_missing("search", self.lang, data["label"])
+
+    def fetch(self, data, titles):
+        return _search_and_fetch_wikipedia(data["label"], self.lang)
+
+
+class CommonsSource(EnrichmentSource):
+    name = "Wikimedia Commons"
+    fields = ("image",)
+    preference = 2
+
+    def applicable(self, data, titles, search):
+        return not cache.is_missing("commons", "", data["label"])
+
+    def fetch(self, data, titles):
+        return _fetch_commons_image(data["label"])
+
+
+class EnrichmentChain:
+    # Sorgenti interrogate in sequenza finché tutti i campi sono pieni
+    def __init__(self, sources: Sequence[EnrichmentSource]):
+        self.sources = list(sources)
+
+    def ordered(self, missing: Tuple[str, ...]) -> List[EnrichmentSource]:
+        if "description" in missing:
+            # La descrizione segue il livello di qualità; dentro il livello prima le sorgenti più rapide e
+            # affidabili. A parità di stime l'ordinamento stabile lascia l'italiano davanti
+            return sorted(self.sources, key=lambda s: (s.preference, -s.score()))
+        # Per la sola immagine la provenienza è indifferente: conta solo il costo misurato
+        return sorted(self.sources, key=lambda s: -s.score())
+
+    def reset(self):
+        # Dimentica le misure raccolte: l'ordine torna quello delle stime iniziali
+        for source in self.sources:
+            source.reset()
+
+    def run(self, data: Dict, titles: Optional[Dict[str, str]] = None, search: bool = True,
+            allow: Optional[Callable[[EnrichmentSource], bool]] = None) -> Dict[str, str]:
+        titles = titles or {}
+        tried = set()
+        while True:
+            missing = _missing_fields(data)
+            if not missing:
+                break
+            # L'ordine si ricalcola a ogni passo: riempita la descrizione cambia il criterio per l'immagine
+            source = next((s for s in self.ordered(missing) if s not in tried), None)
+            if source is None:
+                break
+            tried.add(source)
+            if (allow and not allow(source)) or not set(source.fields) & set(missing) \
+                    or not source.applicable(data, titles, search):
+                metriche.incr("enrichment_source_total", source=source.name, outcome="skipped")
+                continue
+            started = time.perf_counter()
+            hit = _fill_missing(data, source.fetch(data, titles), source.name)
+            source.record(hit, time.perf_counter() - started)
+            metriche.incr("enrichment_source_total", source=source.name, outcome="hit" if hit else "miss")
+        return data
+
+
+chain = EnrichmentChain([SummarySource("it"), SummarySource("en"), SearchSource("it"), SearchSource("en"),
+                         CommonsSource()])
+
+
+def complete_monument_data(data: Dict, titles: Optional[Dict[str, str]] = None, search: bool = True,
+                           retry_langs: Sequence[str] = ()) -> Dict[str, str]:
+    # Dopo i riassunti in blocco restano ricerca per testo e Commons; il riassunto singolo solo per le lingue
+    # in cui la richiesta multipla è fallita
+    def allow(source):
+        if isinstance(source, SummarySource):
+            return source.lang in retry_langs
+        return True
+
+    chain.run(data, titles, search=search, allow=allow)
+    return finalize_monument_data(data)
+
+
+def finalize_monument_data(data: Dict) -> Dict[str, str]:
     if not data["description"]:
         data["description"], data["description_source"] = assign_source(
-            data["description"], "Descrizione non disponibile.", "Nessuna"
+            data["description"], NO_DESCRIPTION, NO_SOURCE
         )
-
     return data
+
+
+def get_monument_data(label: str, desc: str = None, img: str = None, qid: str = None,
+                      titles: Dict[str, str] = None) -> Dict[str, str]:
+    data = _new_record(label, desc, img, qid)
+    titles = titles or {}
+    chain.run(data, titles, search=not titles)
+    return finalize_monument_data(data)
+
+
+def _fetch_wikipedia_batch_chunk(titles: List[str], lang: str) -> Dict[str, Dict[str, str]]:
+    endpoint = rete.wikipedia_url(lang, "/w/api.php")
+    params = {
+        "action": "query", "titles": "|".join(titles), "prop": "extracts|pageimages",
+        "exintro": 1, "explaintext": 1, "exlimit": "max",
+        "piprop": "thumbnail", "pithumbsize": 600, "pilimit": "max",
+        "redirects": 1, "format": "json"
+    }
+    pages = {}
+    absent = set()
+    redirects = {}
+    cont = {}
+    # extracts restituisce al massimo 20 estratti per risposta: si seguono le continuazioni
+    while True:
+        with metriche.timer("enrichment_call_seconds", call="batch", lang=lang):
+            js = rete.get_json(endpoint, params={**params, **cont}, headers=HEADERS, timeout=10) or {}
+        query = js.get("query", {})
+        for mapping in query.get("normalized", []) + query.get("redirects", []):
+            redirects[mapping["from"]] = mapping["to"]
+        for page in query.get("pages", {}).values():
+            if "missing" in page or "invalid" in page:
+                absent.add(page.get("title"))
+                continue
+            entry = pages.setdefault(page["title"], {})
+            if page.get("extract"):
+                entry["description"] = page["extract"]
+            if page.get("thumbnail", {}).get("source"):
+                entry["image"] = page["thumbnail"]["source"]
+        if "continue" not in js:
+            break
+        cont = js["continue"]
+
+    result = {}
+    for title in titles:
+        resolved = title
+        for _ in range(3):
+            if resolved not in redirects:
+                break
+            resolved = redirects[resolved]
+        if resolved in pages:
+            result[title] = pages[resolved]
+        elif resolved in absent:
+            cache.mark_missing("summary", lang, title)
+    return result
+
+
+def fetch_wikipedia_batch(titles: List[str], lang: str) -> Tuple[Dict[str, Dict[str, str]], Set[str]]:
+    # Restituisce le pagine trovate e i titoli dei blocchi falliti, da richiedere poi uno per uno.
+    # I blocchi partono insieme: i limiti per host di rete regolano quante richieste sono davvero in volo
+    titles = list(dict.fromkeys(t for t in titles if t))
+    chunks = [titles[i:i + BATCH_SIZE] for i in range(0, len(titles), BATCH_SIZE)]
+
+    def fetch(chunk):
+        try:
+            return _fetch_wikipedia_batch_chunk(chunk, lang), set()
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠️ Richiesta multipla Wikipedia ({lang}) fallita: {e}")
+            return {}, set(chunk)
+
+    if len(chunks) <= 1:
+        results = [fetch(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="wikipedia-blocchi") as pool:
+            results = list(pool.map(fetch, chunks))
+    found, failed = {}, set()
+    for pages, lost in results:
+        found.update(pages)
+        failed |= lost
+    return found, failed
+
+
+def prepare_monuments_batch(rows: List[Dict]) -> Tuple[List[Dict[str, str]], List[Tuple[str, ...]]]:
+    # Per ogni monumento anche le lingue in cui la richiesta multipla è fallita: lì si ripiega sul
+    # riassunto singolo (SummarySource) durante il completamento
+    records = [_new_record(r["label"], r.get("description"), r.get("image"), r.get("qid")) for r in rows]
+    retry: List[Tuple[str, ...]] = [()] * len(records)
+
+    for lang in ["it", "en"]:
+        # Titolo esatto dal sitelink; il label si usa solo per gli elementi senza alcun sitelink
+        lookups = {}
+        for idx, (row, d) in enumerate(zip(rows, records)):
+            titles = row.get("titles") or {}
+            if is_complete(d) or (titles and lang not in titles):
+                continue
+            title = titles.get(lang, d["label"])
+            if not cache.is_missing("summary", lang, title):
+                lookups[idx] = (idx, d, title)
+        if not lookups:
+            continue
+        found, failed = fetch_wikipedia_batch([title for _, _, title in lookups.values()], lang)
+        for idx, d, title in lookups.values():
+            _update_if_missing(d, found.get(title, {}), lang, "Wikipedia-summary")
+            if title in failed:
+                retry[idx] += (lang,)
+
+    return records, retry
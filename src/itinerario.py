@@ -1,64 +1,140 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
-import time
-from qualita import quality_score
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import archivio
+import classi
+import gazetteer
+import metriche
+import rete
+from typing import Dict, Iterator, List, Optional, Tuple
 from unidecode import unidecode
-from info_monumento import extract_description, get_monument_data
+from info_monumento import _new_record, extract_description, extract_sitelinks, finalize_monument_data
+from arricchimento import DEFAULT_WORKERS, iter_enriched
+from geo import cluster_by_capacity, haversine, parse_wkt_point, plan_route
+from monumento import as_columns
+from qualita import ranking_scores
+import numpy as np
 
 HEADERS = {
     "User-Agent": "TRIPlanner/1.0 (for academic use)"
 }
 
+CITY_QUERY_TIMEOUT = 120
+MONUMENT_QUERY_TIMEOUT = 60
+# Query a pagine: richieste contemporanee e tentativi per pagina (una pagina lenta non blocca le altre)
+PAGE_CONCURRENCY = 3
+PAGE_RETRIES = 1
+# Candidati rimasti fuori dai giorni restituiti come alternative (la riserva dell'itinerario)
+RESERVE_SIZE = 10
 
-def unique_by_label(monuments):
+
+def unique_by_qid(rows):
     seen = set()
     result = []
-    for m in monuments:
-        if m["label"] not in seen:
-            result.append(m)
-            seen.add(m["label"])
+    for r in rows:
+        qid = r.get("qid")
+        if qid and qid in seen:
+            continue
+        result.append(r)
+        seen.add(qid)
     return result
 
 
-def fetch_monuments(city: str, limit: int = 100) -> List[Dict]:
+def fetch_monuments(city: str, limit: int = 100, max_workers: int = DEFAULT_WORKERS) -> List[Dict]:
     qid = get_city_qid(city)
     if not qid:
         print(f"⚠️ Nessuna QID trovata univoca per la città '{city}'")
         return []
-    return fetch_monuments_by_qid(qid, limit)
-
-
-def plan_itinerary_by_popularity(monuments: List[Dict], days: int, per_day: int = 4) -> List[List[Dict]]:
-
-    groups = {2: [], 1: [], 0: []}
-    for m in monuments:
-        score = quality_score(m)
-        groups[score].append(m)
-
-    itinerary = [[] for _ in range(days)]
+    return fetch_monuments_by_qid(qid, limit, max_workers)
+
+
+def day_capacities(days: int, per_day: int = 4, capacities: Optional[List[int]] = None) -> List[int]:
+    if capacities is None:
+        return [per_day] * days
+    if len(capacities) != days:
+        raise ValueError("Il numero di capienze deve coincidere con il numero di giorni")
+    return [max(0, int(c)) for c in capacities]
+
+
+def round_robin_slots(capacities: List[int]) -> List[int]:
+    # Ordine dei posti disponibili: un monumento per giorno a turno, saltando i giorni già pieni
+    return [day for turn in range(max(capacities, default=0))
+            for day, capacity in enumerate(capacities) if capacity > turn]
+
+
+class Itinerary(list):
+    # Un elenco di monumenti per giorno, più la riserva: i candidati rimasti fuori, in ordine di priorità
+    def __init__(self, days=(), reserve: Optional[List[Dict]] = None):
+        super().__init__(days)
+        self.reserve = reserve or []
+
+
+def _fill_round_robin(itinerary: Itinerary, selected: List[Dict], caps: List[int]):
+    for day, monument in zip(round_robin_slots(caps), selected):
+        itinerary[day].append(monument)
+
+
+def _fill_by_distance(itinerary: Itinerary, table, chosen: np.ndarray, caps: List[int]):
+    # I monumenti di ogni giorno sono vicini tra loro e visitati in un ordine che riduce gli spostamenti
+    has_coord = table.located[chosen]
+    located = table.take(chosen[has_coord])
+    unlocated = table.take(chosen[~has_coord])
+
+    if located:
+        coords = table.coords(chosen[has_coord])
+        dist = haversine(coords)
+        # Capienze bilanciate: i monumenti senza coordinate occupano i posti rimasti liberi
+        balanced = [0] * len(caps)
+        for day in round_robin_slots(caps)[:len(located)]:
+            balanced[day] += 1
+        for day, members in enumerate(cluster_by_capacity(coords, balanced, dist)):
+            if members:
+                order = plan_route(dist[np.ix_(members, members)])
+                itinerary[day] = [located[members[i]] for i in order]
+
+    for monument in unlocated:
+        day = min((d for d in range(len(caps)) if len(itinerary[d]) < caps[d]), key=lambda d: len(itinerary[d]))
+        itinerary[day].append(monument)
+
+
+def allocate_itinerary(monuments, days: int, per_day: int = 4, capacities: Optional[List[int]] = None,
+                       by_distance: bool = False, reserve_size: Optional[int] = RESERVE_SIZE) -> Itinerary:
+    # Si scelgono i migliori sum(capienze) candidati (top-k sulle colonne della città); dei restanti solo i
+    # migliori reserve_size vanno in riserva (None: tutti)
+    caps = day_capacities(days, per_day, capacities)
+    table = as_columns(monuments)
+    scores = ranking_scores(table)
+    chosen = table.top_k(sum(caps), scores)
+
+    itinerary = Itinerary([[] for _ in caps], table.take(table.reserve(chosen, scores, reserve_size)))
+    if by_distance:
+        _fill_by_distance(itinerary, table, chosen, caps)
+    else:
+        _fill_round_robin(itinerary, table.take(chosen), caps)
+    return itinerary
 
-    def distribute(monuments_list, start_day, plan):
-        day = start_day
-        for monument in monuments_list:
-            while len(plan[day]) >= per_day:
-                day = (day + 1) % days
-            plan[day].append(monument)
-            day = (day + 1) % days
-        return day
 
-    next_day = distribute(groups[2], 0, itinerary)
-    next_day = distribute(groups[1], next_day, itinerary)
-    distribute(groups[0], next_day, itinerary)
+@metriche.timed("stage_seconds", stage="plan", strategy="popularity")
+def plan_itinerary_by_popularity(monuments, days: int, per_day: int = 4,
+                                 capacities: Optional[List[int]] = None) -> Itinerary:
+    return allocate_itinerary(monuments, days, per_day, capacities)
 
-    return itinerary
 
+@metriche.timed("stage_seconds", stage="plan", strategy="distance")
+def plan_itinerary_by_distance(monuments, days: int, per_day: int = 4,
+                               capacities: Optional[List[int]] = None) -> Itinerary:
+    # Stessa priorità del piano per popolarità, con i giorni raggruppati per vicinanza
+    return allocate_itinerary(monuments, days, per_day, capacities, by_distance=True)
 
-def find_city_candidates(city_name: str) -> List[Dict[str, str]]:
 
-    sparql = SPARQLWrapper("https://query.wikidata.org/sparql")
-    sparql.setReturnFormat(JSON)
-    sparql.setTimeout(120)
-    sparql.agent = "Mozilla/5.0 (TRIPlanner/1.0)"
+@metriche.timed("stage_seconds", stage="city_resolution")
+def find_city_candidates(city_name: str, use_gazetteer: bool = True) -> List[Dict[str, str]]:
+    if use_gazetteer:
+        local, trusted = gazetteer.get_gazetteer().lookup(city_name)
+        if trusted:
+            metriche.incr("city_lookups_total", source="gazetteer")
+            return local
+    else:
+        local = []
+    metriche.incr("city_lookups_total", source="sparql")
 
     city_name_normalized = unidecode(city_name.strip().lower())
     query = f"""
@@ -66,55 +142,49 @@ def find_city_candidates(city_name: str) -> List[Dict[str, str]]:
       ?city rdfs:label ?label .
       FILTER(LANG(?label) = "it" || LANG(?label) = "en")
       FILTER(CONTAINS(LCASE(STR(?label)), LCASE("{city_name_normalized}")))
-      ?city wdt:P31/wdt:P279* wd:Q515 .
+{classi.class_constraint("city", CITY_CLASSES, class_var="cityClass")}
+
+{classi.exclusion_constraint("city", EXCLUDED_CITY_CLASSES)}
 
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q24354 }}    # teatro
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q6581615 }}    # terme
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q839954 }}   # sito archeologico
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q13226383 }} # edificio.
-      
       OPTIONAL {{ ?city wdt:P17 ?country . }}
       SERVICE wikibase:label {{ bd:serviceParam wikibase:language "it,en". }}
     }}
     LIMIT 20
     """
 
-    sparql.setQuery(query)
-
-    for attempt in range(3):
-        try:
-            res = sparql.query().convert()
-            city_by_qid = {}
-            for b in res["results"]["bindings"]:
-                qid = b["city"]["value"].split("/")[-1]
-
-                label = b.get("label", {}).get("value", "")
-                lang = b.get("labelLang", {}).get("value", "")
-                country = b.get("countryLabel", {}).get("value")
-
-                if not country:
-                    continue
-
-                if qid not in city_by_qid:
-                    city_by_qid[qid] = {
-                        "qid": qid,
-                        "label": label,
-                        "country": country,
-                        "lang": lang
-                    }
-                else:
-                    if lang == "it":
-                        city_by_qid[qid]["label"] = label
-                        city_by_qid[qid]["lang"] = lang
-
-            return list(city_by_qid.values())
-
-        except Exception as e:
-            print(f"❌ Tentativo {attempt + 1} fallito: {e}")
-            if attempt < 2:
-                time.sleep(2)
+    try:
+        res = rete.sparql(query, timeout=CITY_QUERY_TIMEOUT)
+        city_by_qid = {}
+        for b in res["results"]["bindings"]:
+            qid = b["city"]["value"].split("/")[-1]
+
+            label = b.get("label", {}).get("value", "")
+            lang = b.get("labelLang", {}).get("value", "")
+            country = b.get("countryLabel", {}).get("value")
+
+            if not country:
+                continue
+
+            if qid not in city_by_qid:
+                city_by_qid[qid] = {
+                    "qid": qid,
+                    "label": label,
+                    "country": country,
+                    "lang": lang
+                }
             else:
-                return []
+                if lang == "it":
+                    city_by_qid[qid]["label"] = label
+                    city_by_qid[qid]["lang"] = lang
+
+        candidates = list(city_by_qid.values())
+        gazetteer.learn(candidates, city_name)
+        return candidates
+
+    except Exception as e:
+        print(f"❌ Query fallita: {e}")
+        # Senza rete restano le corrispondenze locali non confermate, meglio di nessun risultato
+        return local
 
 
 def get_city_qid(city_name: str) -> str:
@@ -122,63 +192,201 @@ def get_city_qid(city_name: str) -> str:
     return cities[0]["qid"] if len(cities) == 1 else None
 
 
-def fetch_monuments_by_qid(qid: str, limit: int = 100) -> List[Dict]:
-    sparql = SPARQLWrapper("https://query.wikidata.org/sparql", agent="TRIPlanner/1.0 "
-                                                                      "(offline educational use)")
-    sparql.setReturnFormat(JSON)
-    sparql.setTimeout(60)
-
-    monument_query = f"""
-    SELECT DISTINCT ?itemLabel ?image ?coord ?description WHERE {{
+CITY_CLASSES = [
+    ("Q515", "città"),
+]
+
+EXCLUDED_CITY_CLASSES = [
+    ("Q24354", "teatro"),
+    ("Q6581615", "terme"),
+    ("Q839954", "sito archeologico"),
+    ("Q13226383", "edificio"),
+]
+
+MONUMENT_CLASSES = [
+    ("Q33506", "museo"),
+    ("Q16970", "chiesa"),
+    ("Q2977", "cattedrale"),
+    ("Q163687", "basilica"),
+    ("Q16966", "duomo"),
+    ("Q44539", "tempio"),
+    ("Q811979", "struttura architettonica"),
+    ("Q570116", "attrazione turistica"),
+    ("Q24354", "teatro"),
+    ("Q170980", "obelisco"),
+    ("Q23413", "castello"),
+    ("Q483453", "fontana"),
+]
+
+EXCLUDED_MONUMENT_CLASSES = [
+    ("Q55488", "escludi stazioni ferroviarie"),
+    ("Q1248784", "escludi aeroporti"),
+    ("Q483110", "stadi"),
+    ("Q16917", "ospedali"),
+    ("Q3918", "politecnici / università politecniche"),
+]
+
+
+class MonumentList(list):
+    # Lista di monumenti con l'indicazione se alcune pagine della query sono fallite
+    # e se le righe vengono dall'archivio locale invece che da Wikidata
+    partial = False
+    offline = False
+
+
+def build_monument_query(qid: str, limit: int, classes=None) -> str:
+    classes = classes or MONUMENT_CLASSES
+    # Le chiusure P279* sono precalcolate (classi.py): nella query restano solo wdt:P31 e insiemi VALUES
+    included = classi.class_constraint("item", classes)
+    excluded = classi.exclusion_constraint("item", EXCLUDED_MONUMENT_CLASSES)
+    # Una riga per elemento: LIMIT conta i monumenti e non le combinazioni di immagini/descrizioni;
+    # con più candidati del limite si tengono i più noti (numero di sitelink), come nell'archivio locale
+    return f"""
+    SELECT ?item (SAMPLE(?lbl) AS ?itemLabel) (SAMPLE(?img) AS ?image) (SAMPLE(?crd) AS ?coord)
+           (SAMPLE(?descIt) AS ?descriptionIt) (SAMPLE(?descEn) AS ?descriptionEn)
+           (SAMPLE(?itArticleTitle) AS ?itTitle) (SAMPLE(?enArticleTitle) AS ?enTitle)
+           (MAX(?links) AS ?sitelinks) WHERE {{
       ?item wdt:P131 wd:{qid} .
-      ?item wdt:P31/wdt:P279* ?class .
-      VALUES ?class {{
-        wd:Q33506   # museo
-        wd:Q16970   # chiesa
-        wd:Q2977    # cattedrale
-        wd:Q163687  # basilica
-        wd:Q16966   # duomo
-        wd:Q44539   # tempio
-        wd:Q811979  # struttura architettonica
-        wd:Q570116  # attrazione turistica
-        wd:Q24354   # teatro
-        wd:Q170980  # obelisco
-        wd:Q23413   # castello
-        wd:Q483453  # fontana
+{included}
+
+{excluded}
+
+      OPTIONAL {{ ?item wdt:P18 ?img. }}
+      OPTIONAL {{ ?item wdt:P625 ?crd. }}
+      OPTIONAL {{ ?item wikibase:sitelinks ?links. }}
+      OPTIONAL {{ ?item schema:description ?descIt. FILTER(LANG(?descIt) = "it") }}
+      OPTIONAL {{ ?item schema:description ?descEn. FILTER(LANG(?descEn) = "en") }}
+      OPTIONAL {{ ?itArticle schema:about ?item ;
+                             schema:isPartOf <https://it.wikipedia.org/> ;
+                             schema:name ?itArticleTitle . }}
+      OPTIONAL {{ ?enArticle schema:about ?item ;
+                             schema:isPartOf <https://en.wikipedia.org/> ;
+                             schema:name ?enArticleTitle . }}
+      SERVICE wikibase:label {{
+        bd:serviceParam wikibase:language "it,en".
+        ?item rdfs:label ?lbl.
       }}
-      
-      MINUS {{ ?item wdt:P31/wdt:P279* wd:Q55488 }}  # escludi stazioni ferroviarie
-      MINUS {{ ?item wdt:P31/wdt:P279* wd:Q1248784 }}  # escludi aeroporti
-      MINUS {{ ?item wdt:P31/wdt:P279* wd:Q483110 }}  # stadi
-      MINUS {{ ?item wdt:P31/wdt:P279* wd:Q16917 }}   # ospedali
-      MINUS {{ ?item wdt:P31/wdt:P279* wd:Q3918 }}    # politecnici / università politecniche
-      
-      OPTIONAL {{ ?item wdt:P18 ?image. }}
-      OPTIONAL {{ ?item wdt:P625 ?coord. }}
-      OPTIONAL {{ ?item schema:description ?description. }}
-      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "it,en". }}
-    }} LIMIT {limit}
+    }}
+    GROUP BY ?item
+    ORDER BY DESC(?sitelinks)
+    LIMIT {limit}
     """
-    sparql.setQuery(monument_query)
-    for attempt in range(3):
-        try:
-            print("📡 Query da QID in corso...")
-            res = sparql.query().convert()
-            bindings = res.get("results", {}).get("bindings", [])
-            monuments = []
-
-            for b in bindings:
-                label = b.get("itemLabel", {}).get("value", "Sconosciuto")
 
-                desc = extract_description(b)
-                img = b.get("image", {}).get("value")
-                monuments.append(get_monument_data(label, desc, img))
 
-            return unique_by_label(monuments)
+def _parse_monument_rows(res: Dict) -> List[Dict]:
+    rows = []
+    for b in res.get("results", {}).get("bindings", []):
+        label = b.get("itemLabel", {}).get("value", "Sconosciuto")
+        item_qid = b.get("item", {}).get("value", "").split("/")[-1] or None
 
-        except Exception as e:
-            print(f"❌ Tentativo {attempt + 1} fallito: {e}")
-            if attempt < 2:
-                time.sleep(2)
-            else:
-                return []
+        desc = extract_description(b)
+        img = b.get("image", {}).get("value")
+        try:
+            sitelinks = int(b.get("sitelinks", {}).get("value") or 0)
+        except ValueError:
+            sitelinks = 0
+        rows.append({"qid": item_qid, "label": label, "description": desc, "image": img,
+                     "titles": extract_sitelinks(b), "coord": parse_wkt_point(b.get("coord", {}).get("value")),
+                     "sitelinks": sitelinks})
+    return rows
+
+
+def fetch_monument_rows_paged(qid: str, limit: int = 100,
+                              max_concurrency: int = PAGE_CONCURRENCY) -> MonumentList:
+    # Una pagina per classe del blocco VALUES: le pagine scadute vengono saltate invece di far fallire tutto
+    pages = [[cls] for cls in MONUMENT_CLASSES]
+    results: List[Optional[List[Dict]]] = [None] * len(pages)
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="sparql-pagine") as pool:
+        futures = {
+            pool.submit(rete.sparql, build_monument_query(qid, limit, page),
+                        timeout=MONUMENT_QUERY_TIMEOUT, retries=PAGE_RETRIES): idx
+            for idx, page in enumerate(pages)
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                results[idx] = _parse_monument_rows(future.result())
+            except Exception as e:
+                print(f"⚠️ Pagina '{pages[idx][0][1]}' fallita: {e}")
+
+    failed = sum(1 for r in results if r is None)
+    if failed == len(pages):
+        raise RuntimeError("Tutte le pagine della query sono fallite")
+
+    # Le pagine sono ordinate per sitelink ciascuna: l'unione si riordina prima di applicare il limite
+    merged = sorted((row for r in results if r for row in r), key=lambda row: -row.get("sitelinks", 0))
+    rows = MonumentList(unique_by_qid(merged)[:limit])
+    rows.partial = failed > 0
+    if rows.partial:
+        print(f"⚠️ Risultati parziali: {failed}/{len(pages)} pagine fallite")
+    return rows
+
+
+@metriche.timed("stage_seconds", stage="monument_query")
+def fetch_monument_rows(qid: str, limit: int = 100, paged: Optional[bool] = None) -> MonumentList:
+    # Se la città è nell'archivio locale (archivio.py) non serve alcuna richiesta di rete
+    store = archivio.get_store()
+    if store is not None and store.has_city(qid):
+        rows = MonumentList(unique_by_qid(store.monument_rows(qid, limit)))
+        rows.offline = True
+        metriche.incr("monument_queries_total", source="store")
+        return rows
+
+    # paged=None: prima la query unica, e solo se fallisce la versione a pagine
+    if paged:
+        metriche.incr("monument_queries_total", source="paged")
+        return fetch_monument_rows_paged(qid, limit)
+
+    print("📡 Query da QID in corso...")
+    try:
+        res = rete.sparql(build_monument_query(qid, limit), timeout=MONUMENT_QUERY_TIMEOUT,
+                          retries=PAGE_RETRIES if paged is None else rete.MAX_RETRIES)
+    except Exception as e:
+        if paged is not None:
+            raise
+        print(f"⚠️ Query unica fallita ({e}), passo alla query a pagine")
+        metriche.incr("monument_queries_total", source="paged")
+        return fetch_monument_rows_paged(qid, limit)
+
+    metriche.incr("monument_queries_total", source="sparql")
+
+    # Deduplicazione per QID prima dell'arricchimento: ogni monumento viene interrogato una sola volta.
+    # Righe con lo stesso nome ma QID diversi sono monumenti distinti e restano entrambe
+    return MonumentList(unique_by_qid(_parse_monument_rows(res)))
+
+
+def iter_enriched_monuments(rows: List[Dict],
+                            max_workers: int = DEFAULT_WORKERS) -> Iterator[Tuple[int, Dict, int, int]]:
+    # Restituisce (posizione, monumento, completati, totale) appena ogni monumento è pronto
+    total = len(rows)
+    if getattr(rows, "offline", False):
+        # Righe dall'archivio locale: solo i dati Wikidata, senza arricchimento via rete
+        for idx, row in enumerate(rows):
+            monument = finalize_monument_data(_new_record(row["label"], row["description"] or None,
+                                                          row["image"], row["qid"]))
+            monument["coord"] = row["coord"]
+            monument["sitelinks"] = row.get("sitelinks") or 0
+            yield idx, monument, idx + 1, total
+        return
+    for done, (idx, monument) in enumerate(iter_enriched(rows, max_workers=max_workers), start=1):
+        monument["coord"] = rows[idx]["coord"]
+        monument["sitelinks"] = rows[idx].get("sitelinks") or 0
+        yield idx, monument, done, total
+
+
+def fetch_monuments_by_qid(qid: str, limit: int = 100, max_workers: int = DEFAULT_WORKERS,
+                           paged: Optional[bool] = None) -> MonumentList:
+    try:
+        rows = fetch_monument_rows(qid, limit, paged)
+    except Exception as e:
+        print(f"❌ Query fallita: {e}")
+        return MonumentList()
+
+    monuments = {}
+    with metriche.timer("stage_seconds", stage="enrichment"):
+        for idx, monument, _, _ in iter_enriched_monuments(rows, max_workers):
+            monuments[idx] = monument
+    result = MonumentList(monuments[idx] for idx in sorted(monuments))
+    result.partial = rows.partial
+    result.offline = rows.offline
+    return result
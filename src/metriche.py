@@ -0,0 +1,187 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Limiti dei bucket (secondi) per le durate, come negli istogrammi Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Ultimi campioni conservati per i percentili mostrati nel pannello di debug
+RECENT_SAMPLES = 512
+ENABLED = os.environ.get("TRIPLANNER_METRICS", "1") != "0"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("count", "total", "buckets", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.recent: Deque[float] = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.recent.append(value)
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+class Registry:
+    # Contatori e istogrammi per nome ed etichette; thread-safe e senza dipendenze esterne
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._listeners: List[Callable[[str, str, Dict[str, str], float], None]] = []
+        self.started = time.time()
+
+    def incr(self, name: str, value: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = _key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener("counter", name, dict(key), value)
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not ENABLED:
+            return
+        key = _key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(seconds)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener("timer", name, dict(key), seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[Dict[str, object]]:
+        # Le etichette possono essere completate dentro il blocco (ad esempio l'esito)
+        labels = dict(labels)
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        # Decoratore per misurare ogni chiamata di una funzione
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_listener(self, listener: Callable[[str, str, Dict[str, str], float], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, str, Dict[str, str], float], None]):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def counter_value(self, name: str, **labels) -> float:
+        # Somma su tutte le serie che hanno almeno le etichette indicate
+        wanted = set(_key(labels))
+        with self._lock:
+            return sum(v for k, v in self._counters.get(name, {}).items() if wanted <= set(k))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = {name: [{"labels": dict(k), "value": v} for k, v in sorted(series.items())]
+                        for name, series in sorted(self._counters.items())}
+            histograms = {
+                name: [{"labels": dict(k), "count": h.count, "sum": round(h.total, 6),
+                        "mean": round(h.total / h.count, 6) if h.count else 0.0,
+                        "p50": round(h.percentile(0.5), 6), "p95": round(h.percentile(0.95), 6),
+                        "max": round(max(h.recent, default=0.0), 6)}
+                       for k, h in sorted(series.items())]
+                for name, series in sorted(self._histograms.items())
+            }
+        return {"uptime_s": round(time.time() - self.started, 1), "counters": counters, "timers": histograms}
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=indent)
+
+    def to_prometheus(self, prefix: str = "triplanner_") -> str:
+        def fmt(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = [f'{k}="{v}"' for k, v in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                lines += [f"{prefix}{name}{fmt(k)} {v:g}" for k, v in sorted(series.items())]
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for k, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS + (float("inf"),), h.buckets):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{prefix}{name}_bucket{fmt(k, (('le', le),))} {cumulative}")
+                    lines.append(f"{prefix}{name}_sum{fmt(k)} {h.total:.6f}")
+                    lines.append(f"{prefix}{name}_count{fmt(k)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_text(self) -> str:
+        # Riepilogo leggibile per il pannello di debug e per la riga di comando
+        snap = self.snapshot()
+        lines = [f"Attivo da {snap['uptime_s']:.0f}s", "", "Durate (ms)      n     media     p50     p95     max"]
+        for name, series in snap["timers"].items():
+            for s in series:
+                label = name + ("".join(f" {k}={v}" for k, v in s["labels"].items()))
+                lines.append(f"{label}\n    {s['count']:>10}{s['mean'] * 1000:>10.1f}{s['p50'] * 1000:>8.1f}"
+                             f"{s['p95'] * 1000:>8.1f}{s['max'] * 1000:>8.1f}")
+        lines += ["", "Contatori"]
+        for name, series in snap["counters"].items():
+            for s in series:
+                label = "".join(f" {k}={v}" for k, v in s["labels"].items())
+                lines.append(f"{name}{label}: {s['value']:g}")
+        hits, misses = self.counter_value("cache_hits_total"), self.counter_value("cache_misses_total")
+        if hits + misses:
+            lines.append(f"\nCache HTTP: {hits / (hits + misses):.0%} hit ({hits:g}/{hits + misses:g})")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+
+registry = Registry()
+incr = registry.incr
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+snapshot = registry.snapshot
+to_json = registry.to_json
+to_prometheus = registry.to_prometheus
+to_text = registry.to_text
+reset = registry.reset
@@ -0,0 +1,216 @@
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+NO_SOURCE = "Nessuna"
+NO_DESCRIPTION = "Descrizione non disponibile."
+
+# Fonti note, con un codice stabile per gli array per colonna; i nomi nuovi vengono aggiunti in coda
+SOURCES = ["Nessuna", "Wikidata", "Wikipedia-summary-it", "Wikipedia-summary-en",
+           "Wikipedia-search-it", "Wikipedia-search-en", "Wikimedia Commons"]
+_source_codes: Dict[str, int] = {}
+_sources_lock = threading.Lock()
+
+# Bit del campo flags di CityMonuments
+HAS_IMAGE = 1
+HAS_DESCRIPTION = 2
+HAS_COORD = 4
+
+
+def intern_source(name: Optional[str]) -> Optional[str]:
+    # Un solo oggetto stringa per fonte, condiviso da tutti i record
+    if name is None:
+        return None
+    code = _source_codes.get(name)
+    if code is None:
+        code = source_code(name)
+    return SOURCES[code]
+
+
+def source_code(name: str) -> int:
+    code = _source_codes.get(name)
+    if code is not None:
+        return code
+    with _sources_lock:
+        if name not in _source_codes:
+            if name not in SOURCES:
+                SOURCES.append(sys.intern(name))
+            _source_codes[name] = SOURCES.index(name)
+        return _source_codes[name]
+
+
+for _i, _name in enumerate(SOURCES):
+    SOURCES[_i] = sys.intern(_name)
+    _source_codes[_name] = _i
+
+
+class Monument:
+    # Record compatto con la stessa interfaccia dei dizionari usati finora (m["label"], m.get("image"))
+    __slots__ = ("qid", "label", "description", "description_source", "image", "image_source", "coord",
+                 "sitelinks")
+    FIELDS = __slots__
+
+    def __init__(self, qid: Optional[str] = None, label: Optional[str] = None, description: Optional[str] = None,
+                 description_source: str = NO_SOURCE, image: Optional[str] = None, image_source: str = NO_SOURCE,
+                 coord: Optional[Tuple[float, float]] = None, sitelinks: int = 0):
+        self.qid = qid
+        self.label = label
+        self.description = description
+        self.description_source = intern_source(description_source)
+        self.image = image
+        self.image_source = intern_source(image_source)
+        self.coord = coord
+        self.sitelinks = sitelinks
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        if key.endswith("_source"):
+            value = intern_source(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __eq__(self, other) -> bool:
+        # Uguaglianza per valore solo tra Monument: un dizionario con gli stessi campi resta diverso
+        if isinstance(other, Monument):
+            return all(getattr(self, k) == getattr(other, k) for k in self.FIELDS)
+        return NotImplemented
+
+    # Record modificabile come i dizionari che sostituisce: non può fare da chiave né stare in un set
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Monument({self.qid!r}, {self.label!r})"
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.FIELDS]
+
+    def to_dict(self) -> Dict:
+        return dict(self.items())
+
+
+def to_jsonable(obj):
+    # Per json.dumps(default=...): i record diventano dizionari, le tabelle liste di dizionari
+    if isinstance(obj, Monument):
+        return obj.to_dict()
+    if isinstance(obj, CityMonuments):
+        return list(obj.records)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Oggetto di tipo {type(obj).__name__} non serializzabile")
+
+
+def _has_text(value: Optional[str]) -> bool:
+    return bool(value) and bool(value.strip()) and value != NO_DESCRIPTION
+
+
+def _has_image(value: Optional[str]) -> bool:
+    return bool(value) and "placeholder" not in str(value).lower()
+
+
+class CityMonuments:
+    # Monumenti di una città per colonne: coordinate, flag, fonti, segnali di popolarità e punteggi in array NumPy
+    def __init__(self, monuments: Iterable = ()):
+        self.records: List = list(monuments)
+        n = len(self.records)
+        self.lat = np.full(n, np.nan)
+        self.lon = np.full(n, np.nan)
+        self.flags = np.zeros(n, dtype=np.uint8)
+        self.description_source = np.zeros(n, dtype=np.uint8)
+        self.image_source = np.zeros(n, dtype=np.uint8)
+        self.sitelinks = np.zeros(n, dtype=np.int32)
+        self.description_length = np.zeros(n, dtype=np.int32)
+        for i, m in enumerate(self.records):
+            coord = m.get("coord")
+            flags = 0
+            if coord:
+                self.lat[i], self.lon[i] = coord
+                flags |= HAS_COORD
+            if _has_image(m.get("image")):
+                flags |= HAS_IMAGE
+            if _has_text(m.get("description")):
+                flags |= HAS_DESCRIPTION
+                self.description_length[i] = len(m["description"])
+            self.sitelinks[i] = m.get("sitelinks") or 0
+            self.flags[i] = flags
+            self.description_source[i] = source_code(m.get("description_source") or NO_SOURCE)
+            self.image_source[i] = source_code(m.get("image_source") or NO_SOURCE)
+        self.scores = self.quality_scores()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, idx):
+        return self.records[idx]
+
+    def quality_scores(self) -> np.ndarray:
+        # Stesso criterio di qualita.quality_score: un punto per l'immagine e uno per la descrizione
+        return (((self.flags & HAS_IMAGE) > 0).astype(np.float32)
+                + ((self.flags & HAS_DESCRIPTION) > 0).astype(np.float32))
+
+    @property
+    def located(self) -> np.ndarray:
+        return (self.flags & HAS_COORD) > 0
+
+    def coords(self, idx: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        idx = np.asarray(idx, dtype=int)
+        return np.column_stack([self.lat[idx], self.lon[idx]])
+
+    def take(self, idx: Union[Sequence[int], np.ndarray]) -> List:
+        return [self.records[i] for i in np.asarray(idx, dtype=int).tolist()]
+
+    def top_k(self, k: int, scores: Optional[np.ndarray] = None) -> np.ndarray:
+        # Indici dei k punteggi più alti in O(n + k log k) senza ordinare tutto;
+        # a parità di punteggio vale l'ordine di arrivo
+        neg = -(self.scores if scores is None else np.asarray(scores, dtype=float))
+        n = len(neg)
+        k = max(0, min(k, n))
+        if k == 0:
+            return np.zeros(0, dtype=int)
+        if k < n:
+            kth = np.partition(neg, k - 1)[k - 1]
+            better = np.flatnonzero(neg < kth)
+            ties = np.flatnonzero(neg == kth)[:k - len(better)]
+            chosen = np.concatenate([better, ties])
+        else:
+            chosen = np.arange(n)
+        return chosen[np.lexsort((chosen, neg[chosen]))]
+
+    def reserve(self, chosen: np.ndarray, scores: Optional[np.ndarray] = None,
+                limit: Optional[int] = None) -> np.ndarray:
+        # I migliori limit indici esclusi da top_k, nello stesso ordine di priorità: stessa selezione con
+        # np.partition, senza ordinare tutti gli esclusi (limit=None li restituisce tutti)
+        values = self.scores if scores is None else np.asarray(scores, dtype=float)
+        rest = np.ones(len(values), dtype=bool)
+        rest[chosen] = False
+        available = int(rest.sum())
+        k = available if limit is None else min(limit, available)
+        return self.top_k(k, np.where(rest, values, -np.inf))
+
+
+def as_columns(monuments) -> CityMonuments:
+    return monuments if isinstance(monuments, CityMonuments) else CityMonuments(monuments)
@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+import cache
+import rete
+from arricchimento import DEFAULT_WORKERS
+from itinerario import fetch_monuments_by_qid, find_city_candidates, plan_itinerary_by_distance
+from monumento import to_jsonable
+
+QID_RE = re.compile(r"^Q\d+$")
+DEFAULT_JOBS = 4
+DEFAULT_GLOBAL_LIMIT = 16
+DEFAULT_DAYS = 3
+DEFAULT_PER_DAY = 4
+DEFAULT_LIMIT = 100
+
+
+def parse_jobs(lines: Iterable[str]) -> List[Dict]:
+    # Una riga per lavoro: oggetto JSON {"city", "days", "per_day"} oppure "città,giorni[,per_giorno]"
+    jobs = []
+    for n, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            raw = json.loads(line)
+            city = raw.get("city") or raw.get("qid")
+            days, per_day = raw.get("days", DEFAULT_DAYS), raw.get("per_day", DEFAULT_PER_DAY)
+        else:
+            fields = [f.strip() for f in re.split(r"[,\t]", line)]
+            city = fields[0]
+            days = fields[1] if len(fields) > 1 and fields[1] else DEFAULT_DAYS
+            per_day = fields[2] if len(fields) > 2 and fields[2] else DEFAULT_PER_DAY
+        if not city:
+            raise ValueError(f"Riga {n}: città mancante")
+        jobs.append({"line": n, "city": city, "days": int(days), "per_day": int(per_day)})
+    return jobs
+
+
+def resolve_city(city: str) -> Optional[Dict[str, str]]:
+    if QID_RE.match(city):
+        return {"qid": city, "label": city, "country": None}
+    candidates = find_city_candidates(city)
+    # Il primo candidato è il più probabile (nome esatto, poi popolazione)
+    return candidates[0] if candidates else None
+
+
+def run_job(job: Dict, limit: int = DEFAULT_LIMIT, max_workers: int = DEFAULT_WORKERS) -> Dict:
+    result = dict(job, qid=None, label=None, country=None, monuments=0, partial=False, offline=False,
+                  itinerary=None, reserve=[], error=None)
+    timings = {}
+    started = time.perf_counter()
+    try:
+        city = resolve_city(job["city"])
+        timings["resolve"] = time.perf_counter() - started
+        if city is None:
+            raise ValueError("Nessuna città trovata")
+        result.update(qid=city["qid"], label=city.get("label"), country=city.get("country"))
+
+        t = time.perf_counter()
+        monuments = fetch_monuments_by_qid(city["qid"], limit, max_workers)
+        timings["fetch"] = time.perf_counter() - t
+        if not monuments:
+            raise ValueError("Nessun monumento trovato")
+        result.update(monuments=len(monuments), partial=monuments.partial, offline=monuments.offline)
+
+        t = time.perf_counter()
+        itinerary = plan_itinerary_by_distance(monuments, job["days"], job["per_day"])
+        result.update(itinerary=itinerary, reserve=itinerary.reserve)
+        timings["plan"] = time.perf_counter() - t
+    except Exception as e:
+        result["error"] = str(e)
+    timings["total"] = time.perf_counter() - started
+    result["timings"] = {k: round(v, 4) for k, v in timings.items()}
+    return result
+
+
+def _percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def print_summary(results: List[Dict], elapsed: float, out=sys.stderr):
+    print(f"\n{'riga':>5}  {'città':<28}{'mon.':>5}{'risolvi':>9}{'fetch':>9}{'piano':>9}{'totale':>9}  esito",
+          file=out)
+    for r in sorted(results, key=lambda r: r["line"]):
+        t = r["timings"]
+        cols = "".join(f"{t[k]:>9.2f}" if k in t else f"{'-':>9}" for k in ("resolve", "fetch", "plan", "total"))
+        status = f"❌ {r['error']}" if r["error"] else ("⚠️ parziale" if r["partial"] else "✅")
+        print(f"{r['line']:>5}  {(r['label'] or r['city'])[:27]:<28}{r['monuments']:>5}{cols}  {status}", file=out)
+
+    totals = [r["timings"]["total"] for r in results]
+    failed = sum(1 for r in results if r["error"])
+    print(f"\n{len(results)} lavori in {elapsed:.1f}s, {failed} falliti", file=out)
+    if totals:
+        print(f"tempo per lavoro: p50 {_percentile(totals, 0.5):.2f}s  p95 {_percentile(totals, 0.95):.2f}s  "
+              f"max {max(totals):.2f}s", file=out)
+    if cache.get_mode() != "bypass":
+        c = cache.get_cache()
+        print(f"cache HTTP: {c.hits} hit, {c.misses} miss", file=out)
+
+
+def run_batch(jobs: List[Dict], out, concurrency: int = DEFAULT_JOBS, limit: int = DEFAULT_LIMIT,
+              max_workers: int = DEFAULT_WORKERS) -> List[Dict]:
+    # Lavori in thread: limiti per host, token bucket e budget globale di rete restano condivisi
+    results = []
+    write_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="pianifica") as pool:
+        futures = [pool.submit(run_job, job, limit, max_workers) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False, default=to_jsonable) + "\n")
+                out.flush()
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Genera itinerari per molte città senza interfaccia grafica")
+    parser.add_argument("jobs", help="File dei lavori ('-' per stdin): 'città,giorni[,per_giorno]' o JSON per riga")
+    parser.add_argument("--output", "-o", default="-", help="File JSON Lines dei risultati ('-' per stdout)")
+    parser.add_argument("--jobs", "-j", dest="concurrency", type=int, default=DEFAULT_JOBS,
+                        help="Città elaborate in parallelo")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Thread di arricchimento per città")
+    parser.add_argument("--max-requests", type=int, default=DEFAULT_GLOBAL_LIMIT,
+                        help="Richieste HTTP contemporanee in tutto (0 = nessun limite)")
+    parser.add_argument("--per-host", type=int, default=rete.DEFAULT_HOST_LIMIT,
+                        help="Richieste HTTP contemporanee verso lo stesso host")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Monumenti massimi per città")
+    parser.add_argument("--cache-mode", choices=cache.MODES, default=cache.get_mode())
+    args = parser.parse_args(argv)
+
+    cache.set_mode(args.cache_mode)
+    rete.set_global_limit(args.max_requests or None)
+    rete.set_host_limit(args.per_host)
+
+    if args.jobs == "-":
+        jobs = parse_jobs(sys.stdin)
+    else:
+        with open(args.jobs, encoding="utf-8") as f:
+            jobs = parse_jobs(f)
+
+    started = time.perf_counter()
+    if args.output == "-":
+        # I messaggi di avanzamento dei moduli vanno su stderr per non sporcare il JSON Lines
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_batch(jobs, out, args.concurrency, args.limit, args.workers)
+    else:
+        with open(args.output, "w", encoding="utf-8") as out:
+            results = run_batch(jobs, out, args.concurrency, args.limit, args.workers)
+    print_summary(results, time.perf_counter() - started)
+    return 1 if any(r["error"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
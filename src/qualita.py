@@ -1,5 +1,16 @@
 from typing import Dict
 
+import numpy as np
+
+from monumento import as_columns
+
+# Peso della popolarità (0..1) sommata al punteggio di qualità: minore di 1, così non scavalca mai un livello
+POPULARITY_WEIGHT = 0.9
+# Quota dei sitelink nella popolarità; il resto dipende dalla lunghezza della descrizione
+SITELINKS_SHARE = 0.8
+# Oltre questa lunghezza una descrizione non conta di più
+DESCRIPTION_CAP = 600
+
 
 def quality_score(monument: Dict) -> int:
 
@@ -18,3 +29,16 @@ def quality_score(monument: Dict) -> int:
         return 1
     else:
         return 0
+
+
+def ranking_scores(monuments) -> np.ndarray:
+    # Qualità (0, 1, 2) più popolarità: sitelink in scala logaritmica rispetto al più noto della città
+    # e lunghezza della descrizione, tutto calcolato in blocco sulle colonne
+    table = as_columns(monuments)
+    links = np.log1p(table.sitelinks.astype(float))
+    top = links.max() if len(links) else 0.0
+    if top > 0:
+        links /= top
+    description = np.minimum(table.description_length, DESCRIPTION_CAP) / DESCRIPTION_CAP
+    popularity = SITELINKS_SHARE * links + (1 - SITELINKS_SHARE) * description
+    return table.scores + POPULARITY_WEIGHT * popularity
@@ -0,0 +1,238 @@
+import contextlib
+import datetime
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cache
+import metriche
+
+HEADERS = {"User-Agent": "TRIPlanner/1.0 (for academic use)"}
+
+# Indirizzi dei servizi Wikimedia, sostituibili con un server locale per test e benchmark
+WIKIDATA_SPARQL = os.environ.get("TRIPLANNER_SPARQL_URL", "https://query.wikidata.org/sparql")
+WIKIPEDIA_URL = os.environ.get("TRIPLANNER_WIKIPEDIA_URL", "https://{lang}.wikipedia.org")
+COMMONS_URL = os.environ.get("TRIPLANNER_COMMONS_URL", "https://commons.wikimedia.org")
+SPARQL_HEADERS = {**HEADERS, "Accept": "application/sparql-results+json"}
+
+DEFAULT_HOST_LIMIT = 4
+DEFAULT_TIMEOUT = 5
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Attesa massima richiesta da Retry-After che si accetta di rispettare; oltre si rinuncia al nuovo tentativo
+MAX_RETRY_AFTER = 120.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Richieste al secondo e burst massimo per host (token bucket)
+RATE_LIMITS = {
+    "query.wikidata.org": (2.0, 5),
+}
+DEFAULT_RATE_LIMIT = (20.0, 20)
+
+_host_limit = DEFAULT_HOST_LIMIT
+# Tetto opzionale alle richieste contemporanee verso tutti gli host insieme
+_global_slot: Optional[threading.BoundedSemaphore] = None
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_slots_lock = threading.Lock()
+
+_sessions: Dict[str, requests.Session] = {}
+_buckets: Dict[str, "TokenBucket"] = {}
+_pool_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # Dopo un 429 l'host resta fermo per tutti i thread, non solo per chi ha ricevuto l'errore
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def set_endpoints(sparql: Optional[str] = None, wikipedia: Optional[str] = None, commons: Optional[str] = None):
+    global WIKIDATA_SPARQL, WIKIPEDIA_URL, COMMONS_URL
+    WIKIDATA_SPARQL = sparql or WIKIDATA_SPARQL
+    WIKIPEDIA_URL = wikipedia or WIKIPEDIA_URL
+    COMMONS_URL = commons or COMMONS_URL
+
+
+def wikipedia_url(lang: str, path: str) -> str:
+    return WIKIPEDIA_URL.format(lang=lang) + path
+
+
+def commons_url(path: str) -> str:
+    return COMMONS_URL + path
+
+
+def set_host_limit(limit: int):
+    # Da chiamare all'avvio, prima delle richieste: i semafori già distribuiti verrebbero sostituiti
+    global _host_limit
+    if limit < 1:
+        raise ValueError("Il limite per host deve essere almeno 1")
+    with _slots_lock:
+        if limit != _host_limit:
+            _host_limit = limit
+            _host_slots.clear()
+
+
+def set_global_limit(limit: Optional[int]):
+    global _global_slot
+    if limit is not None and limit < 1:
+        raise ValueError("Il limite globale deve essere almeno 1")
+    with _slots_lock:
+        _global_slot = threading.BoundedSemaphore(limit) if limit else None
+
+
+def _global_budget():
+    with _slots_lock:
+        return _global_slot or contextlib.nullcontext()
+
+
+def _host_slot(host: str) -> threading.BoundedSemaphore:
+    with _slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(_host_limit)
+            _host_slots[host] = slot
+        return slot
+
+
+def _session(host: str) -> requests.Session:
+    with _pool_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(_host_limit, 10))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def _bucket(host: str) -> TokenBucket:
+    with _pool_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, capacity = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            bucket = TokenBucket(rate, capacity)
+            _buckets[host] = bucket
+        return bucket
+
+
+def _retry_after(res: requests.Response) -> Optional[float]:
+    value = res.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Formato data HTTP; un valore non valido equivale a nessuna indicazione
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def _backoff(attempt: int) -> float:
+    # Backoff esponenziale con jitter pieno
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method: str, url: str, params: Optional[Dict] = None, data: Optional[Dict] = None,
+            headers: Optional[Dict] = None, timeout: float = DEFAULT_TIMEOUT,
+            retries: int = MAX_RETRIES) -> requests.Response:
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        waited = time.perf_counter()
+        _bucket(host).acquire()
+        metriche.observe("http_queue_seconds", time.perf_counter() - waited, host=host)
+        started = time.perf_counter()
+        try:
+            # Al massimo _host_limit richieste contemporanee verso lo stesso host
+            with _global_budget(), _host_slot(host):
+                res = _session(host).request(method, url, params=params, data=data,
+                                             headers=headers or HEADERS, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metriche.observe("http_request_seconds", time.perf_counter() - started, host=host)
+            metriche.incr("http_requests_total", host=host, status=e.__class__.__name__)
+            if attempt == retries:
+                raise
+            delay = _backoff(attempt)
+            metriche.incr("http_retries_total", host=host, reason=e.__class__.__name__)
+            print(f"🔁 {host}: {e.__class__.__name__}, nuovo tentativo tra {delay:.1f}s")
+        else:
+            metriche.observe("http_request_seconds", time.perf_counter() - started, host=host)
+            metriche.incr("http_requests_total", host=host, status=res.status_code)
+            if res.status_code not in RETRY_STATUS or attempt == retries:
+                return res
+            retry_after = _retry_after(res)
+            if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+                # Riprovare prima del tempo indicato dal server sarebbe inutile: si restituisce la risposta
+                print(f"⚠️ {host}: HTTP {res.status_code}, Retry-After di {retry_after:.0f}s, rinuncio")
+                return res
+            delay = retry_after if retry_after is not None else _backoff(attempt)
+            if res.status_code == 429:
+                _bucket(host).pause(delay)
+            metriche.incr("http_retries_total", host=host, reason=res.status_code)
+            print(f"🔁 {host}: HTTP {res.status_code}, nuovo tentativo tra {delay:.1f}s")
+        time.sleep(delay)
+
+
+def get(url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+        timeout: float = DEFAULT_TIMEOUT) -> requests.Response:
+    return request("GET", url, params=params, headers=headers, timeout=timeout)
+
+
+def get_json(url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+             timeout: float = DEFAULT_TIMEOUT, is_empty: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+    # Restituisce None per le pagine inesistenti (404); entrambe le risposte vengono messe in cache
+    def fetch():
+        res = get(url, params=params, headers=headers, timeout=timeout)
+        if res.status_code == 404:
+            return None
+        res.raise_for_status()
+        return res.json()
+
+    return cache.cached_call(url, params, fetch, is_negative=is_empty)
+
+
+def sparql(query: str, timeout: float = 60, retries: int = MAX_RETRIES) -> Dict:
+    def fetch():
+        res = request("POST", WIKIDATA_SPARQL, data={"query": query}, headers=SPARQL_HEADERS,
+                      timeout=timeout, retries=retries)
+        res.raise_for_status()
+        return res.json()
+
+    return cache.cached_call(WIKIDATA_SPARQL, {"query": query}, fetch,
+                             is_negative=lambda r: not r.get("results", {}).get("bindings"))
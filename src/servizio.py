@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import rete
+from gazetteer import normalize
+from itinerario import fetch_monuments_by_qid, find_city_candidates, plan_itinerary_by_popularity
+from monumento import to_jsonable
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Chiamate bloccanti (rete, SQLite) eseguite in parallelo e richieste distinte in attesa di un posto
+MAX_ACTIVE = 8
+MAX_QUEUE = 64
+BLOCKING_WORKERS = 16
+DEFAULT_DEADLINE = 30.0
+MAX_DEADLINE = 120.0
+MAX_HEADER_BYTES = 16 * 1024
+# Il servizio accetta solo GET: un eventuale corpo viene letto e scartato, entro questo limite
+MAX_BODY_BYTES = 64 * 1024
+IDLE_TIMEOUT = 15.0
+MAX_DAYS = 30
+MAX_PER_DAY = 20
+MAX_LIMIT = 500
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class SingleFlight:
+    # Richieste contemporanee con la stessa chiave condividono un'unica esecuzione
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Client ancora in attesa di ogni esecuzione
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self.started = 0
+        self.joined = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # Evita l'avviso "exception was never retrieved" se tutti i client sono già andati via
+            future.exception()
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, k=key: self._done(k, f))
+            self.started += 1
+        else:
+            self.joined += 1
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            # shield: la scadenza di un client non annulla il lavoro condiviso con gli altri
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                if not future.done():
+                    # Nessun client rimasto (scadenze o disconnessioni): il lavoro condiviso non serve più
+                    future.cancel()
+
+
+class PlanningService:
+    def __init__(self, max_active: int = MAX_ACTIVE, max_queue: int = MAX_QUEUE,
+                 workers: int = BLOCKING_WORKERS, default_deadline: float = DEFAULT_DEADLINE):
+        self.max_queue = max_queue
+        self.default_deadline = default_deadline
+        self.flights = SingleFlight()
+        self._slots = asyncio.Semaphore(max_active)
+        self._waiting = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="servizio")
+        self.stats = {"requests": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+
+    async def _blocking(self, fn: Callable, *args) -> Any:
+        # Coda limitata: oltre max_queue richieste in attesa si risponde subito 503 invece di accumulare
+        if self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Servizio sovraccarico, riprovare più tardi", {"Retry-After": "1"})
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        # Un thread già avviato non si può interrompere: se l'attesa viene annullata il posto si libera
+        # solo quando il thread termina davvero
+        future.add_done_callback(self._release_slot)
+        return await asyncio.shield(future)
+
+    def _release_slot(self, future: asyncio.Future):
+        self._slots.release()
+        if not future.cancelled():
+            # Nessuno legge il risultato se l'attesa è stata annullata: evita l'avviso sull'eccezione persa
+            future.exception()
+
+    async def search_cities(self, query: str):
+        key = ("cities", normalize(query))
+        return await self.flights.do(key, lambda: self._blocking(find_city_candidates, query))
+
+    async def plan(self, qid: str, days: int, per_day: int, limit: int) -> Dict:
+        key = ("monuments", qid, limit)
+        monuments = await self.flights.do(key, lambda: self._blocking(fetch_monuments_by_qid, qid, limit))
+        # Anche la pianificazione (NumPy, clustering) gira nell'executor per non bloccare il ciclo di eventi
+        itinerary = await self._blocking(plan_itinerary_by_popularity, monuments, days, per_day)
+        return {"qid": qid, "days": days, "per_day": per_day, "monuments": len(monuments),
+                "partial": monuments.partial, "offline": monuments.offline, "itinerary": itinerary,
+                "reserve": itinerary.reserve}
+
+    def health(self) -> Dict:
+        return dict(self.stats, inflight=len(self.flights), waiting=self._waiting,
+                    flights_started=self.flights.started, flights_joined=self.flights.joined)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _param(params: Dict, name: str, default=None, cast: Callable = str, low=None, high=None):
+    values = params.get(name)
+    if not values:
+        if default is None:
+            raise HTTPError(400, f"Parametro '{name}' mancante")
+        return default
+    try:
+        value = cast(values[0])
+    except ValueError:
+        raise HTTPError(400, f"Parametro '{name}' non valido")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise HTTPError(400, f"Parametro '{name}' fuori intervallo")
+    return value
+
+
+def _deadline(params: Dict, headers: Dict[str, str], default: float) -> float:
+    raw = headers.get("x-deadline-ms")
+    if raw is not None:
+        try:
+            return min(MAX_DEADLINE, max(0.001, float(raw) / 1000))
+        except ValueError:
+            raise HTTPError(400, "Header 'X-Deadline-Ms' non valido")
+    return _param(params, "deadline", default, float, 0.001, MAX_DEADLINE)
+
+
+async def handle(service: PlanningService, method: str, target: str, headers: Dict[str, str]) -> Tuple[int, Any]:
+    url = urlsplit(target)
+    params = parse_qs(url.query)
+    if method != "GET":
+        raise HTTPError(405, "Metodo non supportato")
+    if url.path == "/health":
+        return 200, service.health()
+
+    service.stats["requests"] += 1
+    deadline = _deadline(params, headers, service.default_deadline)
+    if url.path == "/cities":
+        work = service.search_cities(_param(params, "q"))
+    elif url.path == "/plan":
+        qid = _param(params, "qid")
+        if not qid.startswith("Q") or not qid[1:].isdigit():
+            raise HTTPError(400, "Parametro 'qid' non valido")
+        work = service.plan(qid, _param(params, "days", 3, int, 1, MAX_DAYS),
+                            _param(params, "per_day", 4, int, 1, MAX_PER_DAY),
+                            _param(params, "limit", 100, int, 1, MAX_LIMIT))
+    else:
+        raise HTTPError(404, "Percorso sconosciuto")
+
+    try:
+        return 200, await asyncio.wait_for(work, deadline)
+    except asyncio.TimeoutError:
+        service.stats["timeouts"] += 1
+        raise HTTPError(504, f"Scadenza di {deadline:.3f}s superata")
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+    try:
+        raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "Intestazioni troppo lunghe")
+    lines = raw.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Richiesta non valida")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Header 'Content-Length' non valido")
+    if length < 0:
+        raise HTTPError(400, "Header 'Content-Length' non valido")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Corpo della richiesta troppo grande")
+    if length:
+        try:
+            await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+    return method, target, version, headers
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool,
+                    extra_headers: Optional[Dict[str, str]] = None):
+    body = json.dumps(payload, ensure_ascii=False, default=to_jsonable).encode("utf-8")
+    headers = {"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(body)),
+               "Connection": "keep-alive" if keep_alive else "close", **(extra_headers or {})}
+    head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n" + \
+           "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    writer.write(head.encode("latin-1") + body)
+
+
+async def serve_connection(service: PlanningService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except HTTPError as e:
+                _write_response(writer, e.status, {"error": str(e)}, False)
+                break
+            if request is None:
+                break
+            method, target, version, headers = request
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            started = time.perf_counter()
+            try:
+                status, payload = await handle(service, method, target, headers)
+                extra = {}
+            except HTTPError as e:
+                status, payload, extra = e.status, {"error": str(e)}, e.headers
+            except Exception as e:
+                service.stats["errors"] += 1
+                print(f"❌ Errore nel servizio per {target}: {e}")
+                status, payload, extra = 500, {"error": "Errore interno"}, {}
+            extra["Server-Timing"] = f"total;dur={(time.perf_counter() - started) * 1000:.1f}"
+            _write_response(writer, status, payload, keep_alive, extra)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def run_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, service: Optional[PlanningService] = None,
+                     ready: Optional[Callable[[asyncio.AbstractServer], None]] = None):
+    service = service or PlanningService()
+    server = await asyncio.start_server(lambda r, w: serve_connection(service, r, w), host, port,
+                                        limit=MAX_HEADER_BYTES)
+    if ready:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servizio HTTP per la ricerca delle città e la pianificazione")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-active", type=int, default=MAX_ACTIVE)
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="Scadenza predefinita in secondi")
+    parser.add_argument("--sparql-url", help="Endpoint SPARQL alternativo (ad esempio un server locale di prova)")
+    parser.add_argument("--wikipedia-url", help="Base Wikipedia alternativa, con {lang} per la lingua")
+    parser.add_argument("--commons-url", help="Base Commons alternativa")
+    args = parser.parse_args()
+
+    rete.set_endpoints(args.sparql_url, args.wikipedia_url, args.commons_url)
+
+    async def main():
+        service = PlanningService(args.max_active, args.max_queue, default_deadline=args.deadline)
+        await run_server(args.host, args.port, service,
+                         lambda s: print(f"🌐 Servizio in ascolto su http://{args.host}:{args.port}"))
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
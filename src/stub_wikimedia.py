@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import cache
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "fixtures", "wikimedia.json")
+UPSTREAM = {
+    "sparql": "https://query.wikidata.org/sparql",
+    "wikipedia": "https://{lang}.wikipedia.org",
+    "commons": "https://commons.wikimedia.org",
+}
+MONUMENTS_PER_CITY = 80
+
+# Città note al generatore sintetico: (qid, etichetta, paese, lat, lon)
+CITIES = [
+    ("Q220", "Roma", "Italia", 41.9028, 12.4964),
+    ("Q490", "Milano", "Italia", 45.4642, 9.1900),
+    ("Q2044", "Firenze", "Italia", 43.7696, 11.2558),
+    ("Q2634", "Napoli", "Italia", 40.8518, 14.2681),
+    ("Q641", "Venezia", "Italia", 45.4408, 12.3155),
+    ("Q90", "Parigi", "Francia", 48.8566, 2.3522),
+]
+
+
+class StubConfig:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+def _seeded(key: str) -> random.Random:
+    return random.Random(int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:12], 16))
+
+
+def _bindings(rows):
+    return {"results": {"bindings": [{k: {"value": v} for k, v in row.items() if v is not None} for row in rows]}}
+
+
+def _synthetic_sparql(query: str) -> Dict:
+    closure = re.search(r"SELECT \?c WHERE \{ \?c wdt:P279\* wd:(Q\d+)", query)
+    if closure:
+        return _bindings([{"c": f"http://www.wikidata.org/entity/{closure.group(1)}"}])
+
+    item_city = re.search(r"\?item wdt:P131 wd:(Q\d+)", query)
+    if item_city:
+        qid = item_city.group(1)
+        limit = int((re.search(r"LIMIT (\d+)", query) or [0, MONUMENTS_PER_CITY])[1])
+        known = {c[0]: c for c in CITIES}
+        rng = _seeded(qid)
+        lat, lon = known[qid][3:] if qid in known else (rng.uniform(-60, 60), rng.uniform(-150, 150))
+        rows = []
+        for i in range(min(limit, MONUMENTS_PER_CITY)):
+            item = f"Q9{qid[1:]}{i:03d}"
+            label = f"Monumento {i} di {qid}"
+            # Dati volutamente incompleti: una parte degli elementi passa per Wikipedia e Commons
+            rows.append({
+                "item": f"http://www.wikidata.org/entity/{item}",
+                "itemLabel": label,
+                "descriptionIt": f"Descrizione di {label}" if rng.random() < 0.5 else None,
+                "image": f"http://commons.wikimedia.org/wiki/Special:FilePath/{item}.jpg" if rng.random() < 0.4 else None,
+                "coord": f"Point({lon + rng.uniform(-0.03, 0.03):.5f} {lat + rng.uniform(-0.03, 0.03):.5f})",
+                "itTitle": label if rng.random() < 0.7 else None,
+                "enTitle": f"Monument {i} of {qid}" if rng.random() < 0.5 else None,
+                "sitelinks": str(int(_seeded(item).paretovariate(1.2))),
+            })
+        return _bindings(rows)
+
+    label = re.search(r'CONTAINS\(LCASE\(STR\(\?label\)\), LCASE\("([^"]*)"\)\)', query)
+    if label:
+        needle = label.group(1).lower()
+        return _bindings([{"city": f"http://www.wikidata.org/entity/{qid}", "label": name, "labelLang": "it",
+                           "countryLabel": country}
+                          for qid, name, country, _, _ in CITIES if needle in name.lower()])
+    return _bindings([])
+
+
+def _synthetic_wikipedia(lang: str, path: str, params: Dict[str, str]) -> Tuple[int, Dict]:
+    if "/page/summary/" in path:
+        title = unquote(path.split("/page/summary/", 1)[1]).replace("_", " ")
+        rng = _seeded(f"{lang}:{title}")
+        if rng.random() < 0.2:
+            return 404, {"type": "not_found"}
+        return 200, {"title": title, "extract": f"{title} ({lang}).",
+                     "thumbnail": {"source": f"https://upload.wikimedia.org/{lang}/{title}.jpg"}}
+    if params.get("list") == "search":
+        term = params.get("srsearch", "")
+        hits = [] if _seeded(f"search:{lang}:{term}").random() < 0.3 else [{"title": term}]
+        return 200, {"query": {"search": hits}}
+    if "titles" in params:
+        pages = {}
+        for n, title in enumerate(params["titles"].split("|")):
+            rng = _seeded(f"{lang}:{title}")
+            if rng.random() < 0.2:
+                pages[str(-n - 1)] = {"title": title, "missing": ""}
+                continue
+            page = {"title": title, "extract": f"{title} ({lang})."}
+            if rng.random() < 0.6:
+                page["thumbnail"] = {"source": f"https://upload.wikimedia.org/{lang}/{title}.jpg"}
+            pages[str(n + 1)] = page
+        return 200, {"batchcomplete": "", "query": {"pages": pages}}
+    return 200, {}
+
+
+def _synthetic_commons(params: Dict[str, str]) -> Dict:
+    title = params.get("titles", "")
+    if _seeded(f"commons:{title}").random() < 0.5:
+        return {"query": {"pages": {"-1": {"title": title, "missing": ""}}}}
+    return {"query": {"pages": {"1": {"title": title, "thumbnail": {"source": f"https://upload.wikimedia.org/c/{title}.jpg"}}}}}
+
+
+class StubServer:
+    # Server locale che imita SPARQL, Wikipedia e Commons: risposte registrate se disponibili,
+    # altrimenti generate in modo deterministico; latenza, errori e 429 sono configurabili
+    def __init__(self, config: Optional[StubConfig] = None, fixtures_path: Optional[str] = FIXTURES_PATH,
+                 record: bool = False, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.fixtures_path = fixtures_path
+        self.record = record
+        self.fixtures: Dict[str, Dict] = {}
+        if fixtures_path and os.path.exists(fixtures_path):
+            with open(fixtures_path, encoding="utf-8") as f:
+                self.fixtures = json.load(f)
+        self.counts: Counter = Counter()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def endpoints(self) -> Dict[str, str]:
+        return {"sparql": f"{self.url}/sparql", "wikipedia": f"{self.url}/{{lang}}", "commons": f"{self.url}/commons"}
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-wikimedia", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self.record:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.fixtures_path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.fixtures_path, "w", encoding="utf-8") as f:
+                json.dump(self.fixtures, f, ensure_ascii=False, sort_keys=True)
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def _fault(self) -> Tuple[float, Optional[int]]:
+        cfg = self.config
+        with self._lock:
+            delay = max(0.0, cfg.latency + self._rng.uniform(-cfg.jitter, cfg.jitter))
+            roll = self._rng.random()
+        if roll < cfg.throttle_rate:
+            return delay, 429
+        if roll < cfg.throttle_rate + cfg.error_rate:
+            return delay, 503
+        return delay, None
+
+    def _upstream(self, route: str, lang: Optional[str], path: str, method: str,
+                  params: Dict[str, str]) -> Tuple[int, Dict]:
+        import rete
+
+        if route == "sparql":
+            res = rete.request("POST", UPSTREAM["sparql"], data=params, headers=rete.SPARQL_HEADERS, timeout=60)
+        else:
+            base = UPSTREAM[route].format(lang=lang)
+            res = rete.request(method, base + path, params=params, timeout=10)
+        return res.status_code, res.json() if res.status_code == 200 else {}
+
+    def respond(self, method: str, raw_path: str, params: Dict[str, str]) -> Tuple[int, Dict, Dict[str, str]]:
+        parts = raw_path.lstrip("/").split("/", 1)
+        head, rest = parts[0], "/" + (parts[1] if len(parts) > 1 else "")
+        if head == "sparql":
+            route, lang, path = "sparql", None, ""
+        elif head == "commons":
+            route, lang, path = "commons", None, rest
+        else:
+            route, lang, path = "wikipedia", head, rest
+        label = route if route != "wikipedia" else f"wikipedia-{'summary' if 'summary' in path else 'api'}"
+
+        delay, fault = self._fault()
+        if delay:
+            time.sleep(delay)
+        if fault:
+            with self._lock:
+                self.counts[(label, fault)] += 1
+            return fault, {"error": "iniettato"}, {"Retry-After": f"{self.config.retry_after:g}"} if fault == 429 else {}
+
+        key = cache.make_key(raw_path, params)
+        fixture = self.fixtures.get(key)
+        if fixture is not None:
+            status, body = fixture["status"], fixture["body"]
+        elif self.record:
+            status, body = self._upstream(route, lang, path, method, params)
+            if status in (200, 404):
+                with self._lock:
+                    self.fixtures[key] = {"status": status, "body": body}
+        elif route == "sparql":
+            status, body = 200, _synthetic_sparql(params.get("query", ""))
+        elif route == "commons":
+            status, body = 200, _synthetic_commons(params)
+        else:
+            status, body = _synthetic_wikipedia(lang, path, params)
+        with self._lock:
+            self.counts[(label, status)] += 1
+        return status, body, {}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Intestazioni e corpo vengono scritti separatamente: senza TCP_NODELAY ogni risposta
+            # attenderebbe l'ACK ritardato del client (~40 ms) e falserebbe le misure
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method: str, params: Dict[str, str]):
+                path = urlsplit(self.path).path
+                try:
+                    status, body, headers = stub.respond(method, path, params)
+                except Exception as e:
+                    status, body, headers = 502, {"error": str(e)}, {}
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                self._handle("GET", {k: v[0] for k, v in query.items()})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self._handle("POST", {k: v[0] for k, v in form.items()})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server locale che imita Wikidata, Wikipedia e Commons")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--record", action="store_true",
+                        help="Inoltra le richieste mancanti ai servizi reali e salva le risposte nelle fixture")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, seed=args.seed)
+    stub = StubServer(config, args.fixtures, args.record, port=args.port).start()
+    print(f"🧪 Stub in ascolto su {stub.url} (SPARQL {stub.endpoints()['sparql']})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
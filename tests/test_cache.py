@@ -0,0 +1,150 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+import cache  # noqa: E402
+
+
+class MissingTitlesTest(unittest.TestCase):
+    def setUp(self):
+        self._mode = cache.get_mode()
+        cache.get_cache().clear("missing")
+
+    def tearDown(self):
+        cache.set_mode(self._mode)
+
+    def test_marked_titles_are_skipped_only_in_use_mode(self):
+        cache.set_mode("use")
+        cache.mark_missing("summary", "it", "Titolo inesistente")
+        self.assertTrue(cache.is_missing("summary", "it", "Titolo inesistente"))
+        self.assertFalse(cache.is_missing("summary", "en", "Titolo inesistente"))
+        for mode in ("refresh", "bypass"):
+            cache.set_mode(mode)
+            self.assertFalse(cache.is_missing("summary", "it", "Titolo inesistente"))
+
+    def test_bypass_does_not_write_and_refresh_forgets(self):
+        cache.set_mode("bypass")
+        cache.mark_missing("search", "it", "Qualcosa")
+        cache.set_mode("use")
+        self.assertFalse(cache.is_missing("search", "it", "Qualcosa"))
+
+        cache.mark_missing("search", "it", "Qualcosa")
+        cache.set_mode("refresh")
+        cache.forget_missing("search", "it", "Qualcosa")
+        cache.set_mode("use")
+        self.assertFalse(cache.is_missing("search", "it", "Qualcosa"))
+
+
+def _is_empty(value) -> bool:
+    return not value["results"]
+
+
+class _Clock:
+    # Orologio manuale al posto di time.time
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch.object(cache.time, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = cache.ResponseCache(os.path.join(tempfile.mkdtemp(prefix="triplanner-test-"), "c.sqlite3"))
+        self.addCleanup(self.store.close)
+
+    def test_entries_expire_after_source_ttl(self):
+        self.store.put("k", "wikipedia", {"a": 1})
+        self.clock.now += cache.TTL["wikipedia"] - 1
+        self.assertEqual(self.store.get("k"), (True, {"a": 1}))
+        self.clock.now += 2
+        self.assertEqual(self.store.get("k"), (False, None))
+
+    def test_negative_entries_use_shorter_ttl(self):
+        self.store.put("ok", "wikidata", {"a": 1})
+        self.store.put("ko", "wikidata", None, negative=True)
+        self.clock.now += cache.NEGATIVE_TTL["wikidata"] - 1
+        self.assertEqual(self.store.get("ko"), (True, None))
+        self.clock.now += 2
+        self.assertEqual(self.store.get("ko"), (False, None))
+        self.assertEqual(self.store.get("ok"), (True, {"a": 1}))
+
+    def test_unknown_source_uses_default_ttl(self):
+        self.store.put("k", "altro.example", [1])
+        self.clock.now += cache.DEFAULT_TTL + 1
+        self.assertFalse(self.store.get("k")[0])
+
+    def test_eviction_removes_least_recently_used(self):
+        value = "x" * 100
+        size = len(cache.json.dumps(value))
+        self.store.max_bytes = 3 * size + size // 2
+        for key in ("a", "b", "c"):
+            self.clock.now += 1
+            self.store.put(key, "wikidata", value)
+        self.clock.now += 1
+        self.assertTrue(self.store.get("a")[0])
+
+        self.clock.now += 1
+        self.store.put("d", "wikidata", value)
+        present = {key for key in "abcd" if self.store.get(key, count=False)[0]}
+        self.assertEqual(present, {"a", "c", "d"})
+        self.assertLessEqual(self.store._total, self.store.max_bytes)
+
+    def test_eviction_drops_expired_entries_first(self):
+        # La voce scaduta è la più recente: senza pulizia delle scadute verrebbe eliminata "a"
+        value = "x" * 100
+        size = len(cache.json.dumps(value))
+        self.store.max_bytes = 3 * size + size // 2
+        for key in ("a", "b"):
+            self.clock.now += 1
+            self.store.put(key, "wikidata", value)
+        self.clock.now += 1
+        self.store.put("scaduta", "wikidata", value, negative=True)
+        self.clock.now += cache.NEGATIVE_TTL["wikidata"] + 1
+        self.store.put("c", "wikidata", value)
+        present = {key for key in ("a", "b", "c", "scaduta") if self.store.get(key, count=False)[0]}
+        self.assertEqual(present, {"a", "b", "c"})
+
+class CachedCallTest(unittest.TestCase):
+    def setUp(self):
+        self._mode = cache.get_mode()
+        cache.set_mode("use")
+        self.clock = _Clock()
+        patcher = mock.patch.object(cache.time, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.endpoint = f"https://www.wikidata.org/test/{self.id()}"
+
+    def tearDown(self):
+        cache.get_cache().delete(cache.make_key(self.endpoint, {"q": 1}))
+        cache.set_mode(self._mode)
+
+    def test_negative_result_is_cached_until_negative_ttl(self):
+        fetch = mock.Mock(return_value={"results": []})
+        for _ in range(2):
+            self.assertEqual(cache.cached_call(self.endpoint, {"q": 1}, fetch, _is_empty), {"results": []})
+        self.assertEqual(fetch.call_count, 1)
+
+        self.clock.now += cache.NEGATIVE_TTL["wikidata"] + 1
+        cache.cached_call(self.endpoint, {"q": 1}, fetch, _is_empty)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_positive_result_outlives_negative_ttl(self):
+        fetch = mock.Mock(return_value={"results": [1]})
+        cache.cached_call(self.endpoint, {"q": 1}, fetch, _is_empty)
+        self.clock.now += cache.NEGATIVE_TTL["wikidata"] + 1
+        cache.cached_call(self.endpoint, {"q": 1}, fetch, _is_empty)
+        self.assertEqual(fetch.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
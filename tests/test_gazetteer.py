@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+import itinerario  # noqa: E402
+from gazetteer import GAZETTEER_PATH, Gazetteer, read_entries  # noqa: E402
+
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer(read_entries(GAZETTEER_PATH))
+
+    def test_full_name_is_trusted(self):
+        for name, qid in (("Roma", "Q220"), ("monaco di baviera", "Q1726"), ("Munich", "Q1726"),
+                          ("New York", "Q60")):
+            candidates, trusted = self.gazetteer.lookup(name)
+            self.assertTrue(trusted, name)
+            self.assertEqual(candidates[0]["qid"], qid)
+
+    def test_partial_name_is_not_trusted(self):
+        # Il Principato di Monaco e la città di York non sono nel file: serve la query SPARQL
+        for name, qid in (("Monaco", "Q1726"), ("York", "Q60")):
+            candidates, trusted = self.gazetteer.lookup(name)
+            self.assertFalse(trusted, name)
+            self.assertIn(qid, [c["qid"] for c in candidates])
+
+    def test_typo_is_not_trusted(self):
+        candidates, trusted = self.gazetteer.lookup("Milamo")
+        self.assertFalse(trusted)
+        self.assertIn("Q490", [c["qid"] for c in candidates])
+
+    def test_learned_city_with_full_name_is_trusted(self):
+        self.gazetteer.add([{"qid": "Q235", "label_it": "Monaco", "label_en": "Monaco", "country": "Monaco",
+                             "population": 0}])
+        candidates, trusted = self.gazetteer.lookup("Monaco")
+        self.assertTrue(trusted)
+        self.assertEqual(candidates[0]["qid"], "Q235")
+
+
+class FindCityCandidatesTest(unittest.TestCase):
+    @staticmethod
+    def _sparql(query, **kwargs):
+        if "?city rdfs:label" not in query:
+            return {"results": {"bindings": []}}
+        return {"results": {"bindings": [
+            {"city": {"value": "http://www.wikidata.org/entity/Q42462"}, "label": {"value": "York"},
+             "labelLang": {"value": "en"}, "countryLabel": {"value": "Regno Unito"}},
+            {"city": {"value": "http://www.wikidata.org/entity/Q60"}, "label": {"value": "New York"},
+             "labelLang": {"value": "it"}, "countryLabel": {"value": "Stati Uniti d'America"}},
+        ]}}
+
+    def test_partial_name_queries_sparql(self):
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=self._sparql) as sparql:
+            candidates = itinerario.find_city_candidates("York")
+        self.assertTrue(any("?city rdfs:label" in call.args[0] for call in sparql.call_args_list))
+        self.assertEqual({c["qid"] for c in candidates}, {"Q42462", "Q60"})
+        # Con più città il chiamante deve far scegliere: nessun QID scelto in automatico
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=self._sparql):
+            self.assertIsNone(itinerario.get_city_qid("York"))
+
+    def test_full_name_skips_sparql(self):
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=self._sparql) as sparql:
+            candidates = itinerario.find_city_candidates("Roma")
+        sparql.assert_not_called()
+        self.assertEqual(candidates[0]["qid"], "Q220")
+
+
+if __name__ == "__main__":
+    unittest.main()
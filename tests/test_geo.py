@@ -0,0 +1,111 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from geo import cluster_by_capacity, haversine, nearest_neighbour_route, plan_route, two_opt  # noqa: E402
+
+ROMA = (41.9028, 12.4964)
+MILANO = (45.4642, 9.1900)
+
+
+def _points(n: int, seed: int = 0) -> np.ndarray:
+    # Punti sparsi attorno al centro di Roma
+    rng = np.random.default_rng(seed)
+    return np.array(ROMA) + rng.uniform(-0.05, 0.05, size=(n, 2))
+
+
+def _length(route, dist: np.ndarray) -> float:
+    return float(sum(dist[a, b] for a, b in zip(route, route[1:])))
+
+
+class HaversineTest(unittest.TestCase):
+    def test_known_distance(self):
+        d = haversine(np.array([ROMA]), np.array([MILANO]))
+        self.assertEqual(d.shape, (1, 1))
+        self.assertAlmostEqual(float(d[0, 0]), 477, delta=3)
+
+    def test_matrix_is_symmetric_with_zero_diagonal(self):
+        coords = _points(12)
+        d = haversine(coords)
+        self.assertEqual(d.shape, (12, 12))
+        np.testing.assert_allclose(d, d.T)
+        np.testing.assert_allclose(np.diag(d), 0, atol=1e-9)
+        self.assertTrue((d >= 0).all())
+
+    def test_matches_pairwise_computation(self):
+        a, b = _points(5, seed=1), _points(3, seed=2)
+        d = haversine(a, b)
+        self.assertEqual(d.shape, (5, 3))
+        for i in range(5):
+            for j in range(3):
+                self.assertAlmostEqual(float(d[i, j]), float(haversine(a[i:i + 1], b[j:j + 1])[0, 0]))
+
+
+class ClusterByCapacityTest(unittest.TestCase):
+    def _check(self, n, capacities):
+        groups = cluster_by_capacity(_points(n), capacities)
+        self.assertEqual(len(groups), len(capacities))
+        for group, capacity in zip(groups, capacities):
+            self.assertLessEqual(len(group), capacity)
+        self.assertEqual(sorted(i for group in groups for i in group), list(range(n)))
+        return groups
+
+    def test_capacities_are_respected_and_every_point_kept(self):
+        for n, capacities in ((30, [10, 10, 10]), (25, [8, 8, 8, 8]), (7, [3, 2, 2]), (5, [9])):
+            with self.subTest(n=n, capacities=capacities):
+                self._check(n, capacities)
+
+    def test_exact_capacity_fills_every_group(self):
+        groups = self._check(12, [5, 4, 3])
+        self.assertEqual([len(g) for g in groups], [5, 4, 3])
+
+    def test_more_groups_than_points(self):
+        groups = self._check(2, [1, 1, 1])
+        self.assertEqual(sum(len(g) for g in groups), 2)
+
+    def test_separated_clusters_are_not_mixed(self):
+        coords = np.vstack([np.array(ROMA) + np.random.default_rng(3).uniform(-0.01, 0.01, (6, 2)),
+                            np.array(MILANO) + np.random.default_rng(4).uniform(-0.01, 0.01, (6, 2))])
+        groups = cluster_by_capacity(coords, [6, 6])
+        self.assertEqual(sorted(sorted(g) for g in groups), [list(range(6)), list(range(6, 12))])
+
+    def test_insufficient_capacity_raises(self):
+        with self.assertRaises(ValueError):
+            cluster_by_capacity(_points(5), [2, 2])
+
+    def test_empty_input(self):
+        self.assertEqual(cluster_by_capacity(np.zeros((0, 2)), [3, 3]), [[], []])
+
+
+class TwoOptTest(unittest.TestCase):
+    def test_does_not_lengthen_and_keeps_every_stop(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                dist = haversine(_points(20, seed))
+                for route in (nearest_neighbour_route(dist), list(np.random.default_rng(seed).permutation(20))):
+                    improved = two_opt(list(route), dist)
+                    self.assertEqual(sorted(improved), list(range(20)))
+                    self.assertLessEqual(_length(improved, dist), _length(route, dist) + 1e-9)
+
+    def test_untangles_crossing(self):
+        # Quattro punti in linea visitati in ordine incrociato: 2-opt li rimette in fila
+        coords = np.array([[41.90, 12.40], [41.90, 12.42], [41.90, 12.44], [41.90, 12.46]])
+        dist = haversine(coords)
+        self.assertEqual(two_opt([0, 2, 1, 3], dist), [0, 1, 2, 3])
+
+    def test_short_routes_unchanged(self):
+        dist = haversine(_points(3))
+        self.assertEqual(two_opt([2, 0, 1], dist), [2, 0, 1])
+
+    def test_plan_route_visits_every_stop(self):
+        dist = haversine(_points(15))
+        route = plan_route(dist)
+        self.assertEqual(sorted(route), list(range(15)))
+
+
+if __name__ == "__main__":
+    unittest.main()
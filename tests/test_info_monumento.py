@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+import info_monumento  # noqa: E402
+from info_monumento import (CommonsSource, EnrichmentChain, SearchSource, SummarySource,  # noqa: E402
+                            _new_record, complete_monument_data, fetch_wikipedia_batch, prepare_monuments_batch)
+
+
+class _Recorded:
+    # Sorgente che restituisce valori prefissati e annota le chiamate
+    def __init__(self, calls, result):
+        self.calls = calls
+        self.result = result
+
+    def applicable(self, data, titles, search):
+        return True
+
+    def fetch(self, data, titles):
+        self.calls.append(self.name)
+        return self.result
+
+
+class FakeSummary(_Recorded, SummarySource):
+    def __init__(self, lang, calls, result):
+        SummarySource.__init__(self, lang)
+        _Recorded.__init__(self, calls, result)
+
+
+class FakeSearch(_Recorded, SearchSource):
+    def __init__(self, lang, calls, result):
+        SearchSource.__init__(self, lang)
+        _Recorded.__init__(self, calls, result)
+
+
+class FakeCommons(_Recorded, CommonsSource):
+    def __init__(self, calls, result):
+        CommonsSource.__init__(self)
+        _Recorded.__init__(self, calls, result)
+
+
+class EnrichmentChainTest(unittest.TestCase):
+    def test_score_orders_sources_within_tier(self):
+        it, en, search = SummarySource("it"), SummarySource("en"), SearchSource("it")
+        chain = EnrichmentChain([it, en, search])
+        # Senza misure resta l'ordine della lista
+        self.assertEqual(chain.ordered(("description",)), [it, en, search])
+        for _ in range(20):
+            it.record(False, 1.0)
+            en.record(True, 0.05)
+            search.record(True, 0.01)
+        # L'inglese, più rapido e affidabile, passa davanti; la ricerca resta nel livello successivo
+        self.assertEqual(chain.ordered(("description",)), [en, it, search])
+        self.assertEqual(chain.ordered(("image",))[0], search)
+        chain.reset()
+        self.assertEqual(chain.ordered(("description",)), [it, en, search])
+
+    def test_order_recomputed_after_description(self):
+        calls = []
+        summary = FakeSummary("it", calls, {"description": "Descrizione"})
+        search = FakeSearch("it", calls, {})
+        commons = FakeCommons(calls, {"image": "https://example.org/a.jpg"})
+        for _ in range(20):
+            summary.record(True, 1.0)
+            search.record(False, 1.0)
+            commons.record(True, 0.01)
+        chain = EnrichmentChain([summary, search, commons])
+        data = chain.run(_new_record("Colosseo", None, None, "Q10285"))
+        # Riempita la descrizione, per l'immagine si passa subito a Commons senza la ricerca
+        self.assertEqual(calls, ["Wikipedia-summary-it", "Wikimedia Commons"])
+        self.assertEqual(data["image"], "https://example.org/a.jpg")
+
+
+class BatchTest(unittest.TestCase):
+    def test_chunks_fetched_concurrently(self):
+        started, release = [], threading.Barrier(3, timeout=5)
+
+        def chunk(titles, lang):
+            # Ogni blocco aspetta gli altri due: in sequenza la barriera scadrebbe
+            started.append(titles[0])
+            release.wait()
+            return {t: {"description": t} for t in titles}
+
+        titles = [f"T{i}" for i in range(info_monumento.BATCH_SIZE * 3)]
+        with mock.patch.object(info_monumento, "_fetch_wikipedia_batch_chunk", side_effect=chunk):
+            found, failed = fetch_wikipedia_batch(titles, "it")
+        self.assertEqual(len(found), len(titles))
+        self.assertEqual(failed, set())
+        self.assertEqual(len(started), 3)
+
+    def test_failed_batch_falls_back_to_single_summary(self):
+        rows = [{"label": "Colosseo", "qid": "Q10285", "titles": {"it": "Colosseo"}}]
+        with mock.patch.object(info_monumento, "_fetch_wikipedia_batch_chunk",
+                               side_effect=requests.ConnectionError("rete assente")):
+            records, retry = prepare_monuments_batch(rows)
+        self.assertEqual(retry, [("it",)])
+
+        summary = {"description": "Anfiteatro romano", "image": "https://example.org/c.jpg"}
+        with mock.patch.object(info_monumento, "_fetch_wikipedia_summary", return_value=summary) as fetch:
+            data = complete_monument_data(records[0], rows[0]["titles"], search=False, retry_langs=retry[0])
+        fetch.assert_called_once_with("Colosseo", "it")
+        self.assertEqual(data["description"], "Anfiteatro romano")
+        self.assertEqual(data["description_source"], "Wikipedia-summary-it")
+
+
+if __name__ == "__main__":
+    unittest.main()
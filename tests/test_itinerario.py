@@ -0,0 +1,188 @@
+import os
+import re
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+import itinerario  # noqa: E402
+from itinerario import (RESERVE_SIZE, allocate_itinerary, plan_itinerary_by_distance,  # noqa: E402
+                        plan_itinerary_by_popularity)
+from monumento import CityMonuments, Monument  # noqa: E402
+
+
+def _monuments(n, located=True):
+    return [Monument(qid=f"Q{i}", label=f"Monumento {i}", description=f"Descrizione {i}" if i % 2 else None,
+                     image=f"https://example.org/{i}.jpg" if i % 3 else None,
+                     coord=(41.9 + (i % 7) * 0.01, 12.5 + (i % 5) * 0.01) if located else None,
+                     sitelinks=i % 11)
+            for i in range(n)]
+
+
+class TopKTest(unittest.TestCase):
+    def setUp(self):
+        self.columns = CityMonuments(_monuments(6))
+
+    def test_best_scores_in_order(self):
+        scores = np.array([1.0, 5.0, 3.0, 4.0, 2.0, 0.0])
+        self.assertEqual(self.columns.top_k(3, scores).tolist(), [1, 3, 2])
+
+    def test_k_at_least_n_returns_all_sorted(self):
+        scores = np.array([1.0, 5.0, 3.0, 4.0, 2.0, 0.0])
+        for k in (6, 7, 100):
+            with self.subTest(k=k):
+                self.assertEqual(self.columns.top_k(k, scores).tolist(), [1, 3, 2, 4, 0, 5])
+
+    def test_ties_keep_arrival_order(self):
+        scores = np.array([2.0, 1.0, 2.0, 2.0, 3.0, 2.0])
+        self.assertEqual(self.columns.top_k(3, scores).tolist(), [4, 0, 2])
+        self.assertEqual(self.columns.top_k(6, scores).tolist(), [4, 0, 2, 3, 5, 1])
+        self.assertEqual(self.columns.top_k(4, np.zeros(6)).tolist(), [0, 1, 2, 3])
+
+    def test_empty_selection(self):
+        self.assertEqual(self.columns.top_k(0, np.ones(6)).tolist(), [])
+        self.assertEqual(CityMonuments().top_k(5, np.zeros(0)).tolist(), [])
+
+
+class AllocateItineraryTest(unittest.TestCase):
+    def _check(self, itinerary, monuments, caps):
+        self.assertEqual([len(day) for day in itinerary], [min(c, len(day)) for c, day in zip(caps, itinerary)])
+        for day, cap in zip(itinerary, caps):
+            self.assertLessEqual(len(day), cap)
+        scheduled = [m.qid for day in itinerary for m in day]
+        reserve = [m.qid for m in itinerary.reserve]
+        self.assertEqual(len(scheduled), min(sum(caps), len(monuments)))
+        self.assertEqual(len(reserve), min(RESERVE_SIZE, len(monuments) - len(scheduled)))
+        self.assertLessEqual(set(scheduled + reserve), {m.qid for m in monuments})
+        self.assertFalse(set(scheduled) & set(reserve))
+
+    def test_more_monuments_than_slots(self):
+        # Con più candidati dei posti il vecchio ciclo distribute() non terminava
+        monuments = _monuments(60)
+        for plan in (plan_itinerary_by_popularity, plan_itinerary_by_distance):
+            itinerary = plan(monuments, 3, 4)
+            self._check(itinerary, monuments, [4, 4, 4])
+            self.assertEqual(len(itinerary.reserve), RESERVE_SIZE)
+
+    def test_variable_capacities(self):
+        monuments = _monuments(30)
+        caps = [5, 0, 2, 7]
+        for by_distance in (False, True):
+            itinerary = allocate_itinerary(monuments, 4, capacities=caps, by_distance=by_distance)
+            self._check(itinerary, monuments, caps)
+            self.assertEqual(itinerary[1], [])
+
+    def test_fewer_monuments_than_slots(self):
+        monuments = _monuments(5, located=False)
+        itinerary = plan_itinerary_by_distance(monuments, 3, 4)
+        self._check(itinerary, monuments, [4, 4, 4])
+        self.assertEqual(itinerary.reserve, [])
+
+    def test_reserve_is_ranked_after_scheduled(self):
+        monuments = _monuments(20)
+        itinerary = plan_itinerary_by_popularity(monuments, 2, 3)
+        complete = {m.qid for m in monuments if m.description and m.image}
+        scheduled = {m.qid for day in itinerary for m in day}
+        self.assertTrue(scheduled <= complete)
+
+    def test_reserve_is_best_prefix_of_full_reserve(self):
+        monuments = _monuments(60)
+        full = allocate_itinerary(monuments, 2, 3, reserve_size=None)
+        capped = allocate_itinerary(monuments, 2, 3, reserve_size=7)
+        self.assertEqual(len(full.reserve), 54)
+        self.assertEqual([m.qid for m in capped.reserve], [m.qid for m in full.reserve[:7]])
+        scheduled = {m.qid for day in full for m in day}
+        self.assertEqual(sorted([m.qid for m in full.reserve] + list(scheduled)), sorted(m.qid for m in monuments))
+
+    def test_capacities_must_match_days(self):
+        with self.assertRaises(ValueError):
+            allocate_itinerary(_monuments(4), 2, capacities=[1, 2, 3])
+
+
+def _binding(qid, label, sitelinks=0):
+    return {"item": {"value": f"http://www.wikidata.org/entity/{qid}"}, "itemLabel": {"value": label},
+            "sitelinks": {"value": str(sitelinks)}}
+
+
+def _sparql_with(bindings_for):
+    # Risposte SPARQL finte: bindings_for(query) per le query dei monumenti, nessun risultato per le altre
+    def sparql(query, **kwargs):
+        if "?item wdt:P131" not in query:
+            return {"results": {"bindings": []}}
+        return {"results": {"bindings": bindings_for(query)}}
+    return sparql
+
+
+def _mentions(query, cls):
+    return re.search(rf"wd:{cls}\b", query) is not None
+
+
+class FetchMonumentRowsTest(unittest.TestCase):
+    def test_same_label_different_qid_is_kept(self):
+        bindings = [_binding("Q1", "Chiesa di San Pietro", 5), _binding("Q2", "Chiesa di San Pietro", 3),
+                    _binding("Q1", "Chiesa di San Pietro", 5)]
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=_sparql_with(lambda q: bindings)):
+            rows = itinerario.fetch_monument_rows("Q220", 10, paged=False)
+        self.assertEqual([r["qid"] for r in rows], ["Q1", "Q2"])
+
+
+class FetchMonumentRowsPagedTest(unittest.TestCase):
+    # Una pagina per classe: la pagina dei musei (Q33506) e quella delle basiliche (Q163687) hanno risultati,
+    # con un monumento in comune; la pagina delle chiese (Q16970) fallisce
+    PAGES = {
+        "Q33506": [_binding("Q3", "Museo", 50), _binding("Q1", "Palazzo", 5)],
+        "Q163687": [_binding("Q4", "Basilica", 20), _binding("Q3", "Museo", 50)],
+    }
+
+    def _fetch(self, limit=10, failing=("Q16970",)):
+        def bindings_for(query):
+            for cls in failing:
+                if _mentions(query, cls):
+                    raise RuntimeError("timeout")
+            for cls, rows in self.PAGES.items():
+                if _mentions(query, cls):
+                    return rows
+            return []
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=_sparql_with(bindings_for)):
+            return itinerario.fetch_monument_rows("Q220", limit, paged=True)
+
+    def test_pages_are_merged_by_sitelinks_and_deduplicated(self):
+        rows = self._fetch(failing=())
+        self.assertEqual([r["qid"] for r in rows], ["Q3", "Q4", "Q1"])
+        self.assertFalse(rows.partial)
+
+    def test_failed_page_marks_result_partial(self):
+        rows = self._fetch()
+        self.assertEqual([r["qid"] for r in rows], ["Q3", "Q4", "Q1"])
+        self.assertTrue(rows.partial)
+
+    def test_limit_applies_after_merge(self):
+        rows = self._fetch(limit=2)
+        self.assertEqual([r["qid"] for r in rows], ["Q3", "Q4"])
+        self.assertTrue(rows.partial)
+
+    def test_all_pages_failing_raises(self):
+        failing = [cls for cls, _ in itinerario.MONUMENT_CLASSES]
+        with self.assertRaises(RuntimeError):
+            self._fetch(failing=failing)
+
+    def test_single_query_failure_falls_back_to_pages(self):
+        def bindings_for(query):
+            # La query unica contiene tutte le classi e scade; le pagine ne contengono una sola
+            matches = [rows for cls, rows in self.PAGES.items() if _mentions(query, cls)]
+            if len(matches) > 1:
+                raise RuntimeError("timeout")
+            return matches[0] if matches else []
+        with mock.patch.object(itinerario.rete, "sparql", side_effect=_sparql_with(bindings_for)):
+            rows = itinerario.fetch_monument_rows("Q220", 10)
+        self.assertEqual([r["qid"] for r in rows], ["Q3", "Q4", "Q1"])
+        self.assertFalse(rows.partial)
+
+
+if __name__ == "__main__":
+    unittest.main()
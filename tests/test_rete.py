@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+from rete import _retry_after  # noqa: E402
+
+
+def _response(retry_after):
+    res = requests.Response()
+    res.status_code = 429
+    if retry_after is not None:
+        res.headers["Retry-After"] = retry_after
+    return res
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(_retry_after(_response("12")), 12.0)
+        self.assertEqual(_retry_after(_response("-3")), 0.0)
+
+    def test_http_date(self):
+        delay = _retry_after(_response(formatdate(time.time() + 60, usegmt=True)))
+        self.assertAlmostEqual(delay, 60, delta=2)
+
+    def test_missing_or_malformed(self):
+        for value in (None, "soon", "Mon, 99 Foo 2024 99:99:99 GMT"):
+            with self.subTest(value=value):
+                self.assertIsNone(_retry_after(_response(value)))
+
+
+if __name__ == "__main__":
+    unittest.main()
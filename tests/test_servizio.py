@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("TRIPLANNER_CACHE_DIR", tempfile.mkdtemp(prefix="triplanner-test-"))
+
+from servizio import MAX_BODY_BYTES, HTTPError, SingleFlight, _read_request  # noqa: E402
+
+
+def _read(raw: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_request(reader)
+    return asyncio.run(run())
+
+
+class ReadRequestTest(unittest.TestCase):
+    def test_valid_request_with_body(self):
+        method, target, version, headers = _read(b"GET /health HTTP/1.1\r\nContent-Length: 2\r\n\r\nok")
+        self.assertEqual((method, target, version), ("GET", "/health", "HTTP/1.1"))
+
+    def test_invalid_content_length(self):
+        for value, status in (("abc", 400), ("-1", 400), (str(MAX_BODY_BYTES + 1), 413)):
+            with self.subTest(value=value):
+                with self.assertRaises(HTTPError) as ctx:
+                    _read(f"GET /health HTTP/1.1\r\nContent-Length: {value}\r\n\r\n".encode())
+                self.assertEqual(ctx.exception.status, status)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def _run(self, deadlines):
+        # Due client sulla stessa chiave con scadenze diverse; restituisce se il lavoro è stato annullato
+        async def run():
+            flights = SingleFlight()
+            cancelled = asyncio.Event()
+
+            async def work():
+                try:
+                    await asyncio.sleep(0.2)
+                    return "fatto"
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+            results = await asyncio.gather(*(asyncio.wait_for(flights.do("k", work), d) for d in deadlines),
+                                           return_exceptions=True)
+            await asyncio.sleep(0)
+            return results, cancelled.is_set(), len(flights)
+        return asyncio.run(run())
+
+    def test_cancelled_when_all_waiters_time_out(self):
+        results, cancelled, inflight = self._run([0.01, 0.02])
+        self.assertTrue(all(isinstance(r, asyncio.TimeoutError) for r in results))
+        self.assertTrue(cancelled)
+        self.assertEqual(inflight, 0)
+
+    def test_kept_while_a_waiter_remains(self):
+        results, cancelled, _ = self._run([0.01, 1.0])
+        self.assertIsInstance(results[0], asyncio.TimeoutError)
+        self.assertEqual(results[1], "fatto")
+        self.assertFalse(cancelled)
+
+
+if __name__ == "__main__":
+    unittest.main()